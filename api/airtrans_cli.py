@@ -7,16 +7,17 @@ import asyncio
 import argparse
 import sys
 import json
+import time
 from pathlib import Path
 from typing import Optional
 import logging
 from tqdm import tqdm
 import requests
 
-from api.apitran import AirTransSender, AirTransReceiver
+from api.apitran import AirTransSender, AirTransReceiver, install_event_loop
 from api.discovery import PeerDiscovery
 from api.utils import (
-    FileChunker, ChecksumManager, CompressionManager, 
+    FileChunker, ChecksumManager,
     TransferMetadata, format_size, calculate_optimal_chunks
 )
 from config.settings import config
@@ -54,32 +55,43 @@ class AirTransCLI:
             num_parts = calculate_optimal_chunks(filesize)
             print(f"   Auto-selected {num_parts} parallel connections")
         
-        # Compress if requested and file is large enough
-        if compression and filesize > config.COMPRESSION_THRESHOLD:
-            print(f"   Compressing with LZ4...")
-            compressed_path = CompressionManager.compress_file(str(filepath))
-            filepath = Path(compressed_path)
-            print(f"   Compressed to: {format_size(filepath.stat().st_size)}")
+        # Compress if requested and file is large enough (streamed per chunk while sending)
+        compression = compression and filesize > config.COMPRESSION_THRESHOLD
+        if compression:
+            print("   Compressing on the fly with LZ4")
         
         # Create transfer session via API
         try:
             response = requests.post(f"{self.api_base}/create-session", json={
                 'filepath': str(filepath),
                 'num_parts': num_parts,
-                'base_port': config.BASE_PORT,
+                'port': config.BASE_PORT,
                 'compression': compression
             })
             
-            if response.status_code != 201:
+            if response.status_code != 202:
                 print(f"❌ Error creating session: {response.json().get('error')}")
                 return
             
-            session_data = response.json()
-            session_id = session_data['session_id']
-            metadata = session_data['metadata']
+            session_id = response.json()['session_id']
+            
+            # The server hashes the file in the background; wait for the metadata
+            # without blocking the event loop
+            print("   Computing checksum...")
+            while True:
+                response = await asyncio.to_thread(requests.get, f"{self.api_base}/session/{session_id}")
+                if response.status_code != 425:
+                    break
+                await asyncio.sleep(float(response.headers.get('Retry-After', 1)))
+            
+            if response.status_code != 200:
+                print(f"❌ Error creating session: {response.json().get('error')}")
+                return
+            
+            metadata = response.json()['metadata']
             
             print(f"\n✅ Session created: {session_id}")
-            print(f"   Transfer ports: {metadata['ports'][0]} - {metadata['ports'][-1]}")
+            print(f"   Transfer port: {metadata['port']}")
             
             # Display QR code URL
             if not no_qr:
@@ -93,7 +105,8 @@ class AirTransCLI:
             
             # Start transfer
             print(f"\n🚀 Starting transfer...")
-            sender = AirTransSender(str(filepath), num_parts, config.BASE_PORT)
+            sender = AirTransSender(str(filepath), num_parts, config.BASE_PORT, compression,
+                                    checksum=metadata['checksum'])
             
             # Show progress
             with tqdm(total=filesize, unit='B', unit_scale=True, desc="Sending") as pbar:
@@ -104,7 +117,7 @@ class AirTransCLI:
             print(f"\n✅ Transfer complete!")
             print(f"   Average speed: {result['avg_speed_mbps']:.2f} MB/s")
             print(f"   Time elapsed: {result['elapsed']:.2f} seconds")
-            print(f"   Checksum: {result['checksum'][:16]}...")
+            print(f"   Tree checksum: {result['tree_checksum'][:16]}...")
             
         except requests.RequestException as e:
             print(f"❌ API Error: {e}")
@@ -168,9 +181,14 @@ class AirTransCLI:
                 # Start async receive task
                 receive_task = asyncio.create_task(receiver.receive_file(sender_ip))
                 
-                # Update progress
+                # Update progress whenever the receiver signals it
+                progress_event = receiver.session.progress_event
                 while not receive_task.done():
-                    await asyncio.sleep(0.5)
+                    progress_wait = asyncio.create_task(progress_event.wait())
+                    await asyncio.wait([receive_task, progress_wait],
+                                       return_when=asyncio.FIRST_COMPLETED)
+                    progress_wait.cancel()
+                    progress_event.clear()
                     current = receiver.session.bytes_transferred
                     pbar.update(current - last_transferred)
                     last_transferred = current
@@ -178,21 +196,16 @@ class AirTransCLI:
                 output_path = await receive_task
                 pbar.update(metadata['filesize'] - last_transferred)
             
-            # Complete session
-            requests.post(f"{self.api_base}/complete/{session_id}", json={
-                'output_path': output_path,
-                'checksum': metadata['checksum']
-            })
+            # Complete session with the checksums the receiver computed; the API
+            # compares them with the session's instead of hashing the file again
+            verified = {'tree_checksum': receiver.tree_checksum}
+            if receiver.file_checksum:
+                verified['checksum'] = receiver.file_checksum
+            requests.post(f"{self.api_base}/complete/{session_id}", json=verified)
             
             print(f"\n✅ Download complete!")
             print(f"   Saved to: {output_path}")
             
-            # Decompress if needed
-            if metadata.get('compression'):
-                print(f"   Decompressing...")
-                decompressed = CompressionManager.decompress_file(output_path)
-                print(f"   Decompressed to: {decompressed}")
-            
         except requests.RequestException as e:
             print(f"❌ API Error: {e}")
         except Exception as e:
@@ -214,7 +227,6 @@ class AirTransCLI:
         discovery.start(on_peer_found=on_peer_found)
         
         try:
-            import time
             time.sleep(timeout)
         except KeyboardInterrupt:
             print("\n")
@@ -356,7 +368,9 @@ Examples:
     
     args = parser.parse_args()
     
+    config.ensure_dirs()
     cli = AirTransCLI()
+    install_event_loop()
     
     try:
         if args.command == 'send':
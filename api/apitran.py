@@ -4,127 +4,457 @@ Supports parallel chunk transfers with asyncio for maximum throughput
 """
 
 import asyncio
+import collections
+import os
 import time
-import hashlib
-import msgpack
+import mmap
+import socket
+import struct
+import lz4.frame
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 import logging
 
+try:
+    import fcntl  # POSIX only; used to enlarge splice pipes
+except ImportError:
+    fcntl = None
+
+from api.utils import (
+    CRYPTOGRAPHIC_CHUNK_HASHES, ChecksumManager, chunk_hash_algo, chunk_ranges, new_chunk_hash
+)
+from config.settings import config
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Bytes between progress notifications
+PROGRESS_STEP = 4 * 1024 * 1024
+
+# Request frame a receiver opens each connection with: chunk id, block size
+REQUEST_FRAME = struct.Struct('>II')
+
+# Header the sender answers with: chunk id, chunk size
+CHUNK_HEADER = struct.Struct('>IQ')
+
+# Trailer following the chunk data: raw digest of the chunk, zero-padded when
+# the chunk hash is shorter. Sending it last lets data flow while the
+# sender's hashers are still working.
+CHUNK_TRAILER = struct.Struct('>32s')
+
+
+def install_event_loop() -> bool:
+    """Use uvloop for subsequently created event loops when it is available"""
+    if not config.USE_UVLOOP:
+        return False
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
+async def _recv_into(loop: asyncio.AbstractEventLoop, sock: socket.socket, view: memoryview) -> int:
+    """Fill view from a non-blocking socket; returns fewer bytes only on EOF"""
+    pos = 0
+    while pos < len(view):
+        n = await loop.sock_recv_into(sock, view[pos:])
+        if not n:
+            break
+        pos += n
+    return pos
+
+
+async def _recv_exactly(loop: asyncio.AbstractEventLoop, sock: socket.socket, size: int) -> bytearray:
+    """Read exactly size bytes from a non-blocking socket"""
+    buf = bytearray(size)
+    received = await _recv_into(loop, sock, memoryview(buf))
+    if received < size:
+        raise ConnectionError(f"Connection closed after {received} of {size} bytes")
+    return buf
+
+
+def _tune_socket(sock, sndbuf: int = 0, rcvbuf: int = 0):
+    """Disable Nagle and size the kernel socket buffers for bulk transfer"""
+    if config.TCP_NODELAY:
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for option, size in ((socket.SO_SNDBUF, sndbuf), (socket.SO_RCVBUF, rcvbuf)):
+        if size:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, size)
+            except OSError:
+                pass  # Capped or refused by the OS; keep its default
+
+
+# Linux calls it TCP_CORK, the BSDs TCP_NOPUSH
+_TCP_CORK = getattr(socket, 'TCP_CORK', None) or getattr(socket, 'TCP_NOPUSH', None)
+
+
+def _set_cork(sock, corked: bool):
+    """Hold back partial segments so the header and data go out in full packets"""
+    if _TCP_CORK is not None:
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, _TCP_CORK, int(corked))
+        except OSError:
+            pass
+
+
+def _link_speed_bps() -> int:
+    """Fastest active non-loopback interface speed in bits/s, or the configured fallback"""
+    try:
+        import psutil
+        speeds = [
+            stats.speed for name, stats in psutil.net_if_stats().items()
+            if stats.isup and stats.speed > 0 and not name.startswith('lo')
+        ]
+        if speeds:
+            return max(speeds) * 1_000_000
+    except (ImportError, OSError):
+        pass
+    return config.LINK_SPEED_MBPS * 1_000_000
+
+
+def _block_size_for(rtt: float, bandwidth_bps: int, num_parts: int) -> int:
+    """Size I/O blocks so the parallel connections together keep two BDPs in flight"""
+    bdp = int(rtt * bandwidth_bps / 8)
+    return min(max(config.BUFFER_SIZE, 2 * bdp // num_parts), config.MAX_BLOCK_SIZE)
+
+
+def _pwrite_all(fd: int, data: memoryview, offset: int):
+    """Write all of data at offset, retrying on short writes"""
+    while data:
+        n = os.pwrite(fd, data, offset)
+        data = data[n:]
+        offset += n
+
+
+def _checksum_range(fd: int, offset: int, size: int, algorithm: str) -> str:
+    """Hash size bytes of fd starting at offset"""
+    hash_obj = new_chunk_hash(algorithm)
+    block_size = 1024 * 1024  # 1MB blocks
+    end = offset + size
+    while offset < end:
+        block = os.pread(fd, min(block_size, end - offset), offset)
+        if not block:
+            break
+        hash_obj.update(block)
+        offset += len(block)
+    return hash_obj.hexdigest()
+
+
+def _splice_to_file(pipe_r: int, fd: int, offset: int, count: int):
+    """Move count bytes from a pipe into fd at offset, retrying on short splices"""
+    while count:
+        n = os.splice(pipe_r, fd, count, offset_dst=offset, flags=os.SPLICE_F_MOVE)
+        offset += n
+        count -= n
+
+
+async def _wait_readable(loop: asyncio.AbstractEventLoop, sock: socket.socket):
+    """Wait until a non-blocking socket has data (or EOF) to read"""
+    ready = loop.create_future()
+    loop.add_reader(sock.fileno(), lambda: ready.done() or ready.set_result(None))
+    try:
+        await ready
+    finally:
+        loop.remove_reader(sock.fileno())
+
+
+def _advise_sequential(fd: int, offset: int, size: int):
+    """Hint the kernel to read ahead aggressively over a byte range"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, size, os.POSIX_FADV_SEQUENTIAL)
+
+
+def _preallocate(fd: int, size: int):
+    """Reserve size bytes for fd, falling back to a sparse file if unsupported"""
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+class _WriteBehind:
+    """
+    Positional file writes that complete in worker threads while the caller
+    keeps receiving. At most `depth` writes are in flight; submitting another
+    first reaps the oldest, so callers may reuse a buffer once `depth` newer
+    writes have been submitted after it.
+    """
+    
+    def __init__(self, fd: int, depth: int = 2):
+        self.fd = fd
+        self.depth = depth
+        self._in_flight = collections.deque()
+    
+    async def submit(self, data, offset: int):
+        """Queue data to be written at offset"""
+        if len(self._in_flight) >= self.depth:
+            await self._in_flight.popleft()
+        self._in_flight.append(asyncio.ensure_future(
+            asyncio.to_thread(_pwrite_all, self.fd, memoryview(data), offset)
+        ))
+    
+    async def flush(self):
+        """Wait for every queued write to complete"""
+        while self._in_flight:
+            await self._in_flight.popleft()
+
+
+class _BufferPool:
+    """
+    Receive buffers kept for reuse across chunks and transfers. Retention is
+    capped by total bytes, since BDP-sized blocks can be up to MAX_BLOCK_SIZE
+    each; buffers returned beyond the cap are left to the garbage collector.
+    """
+    
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._free = collections.deque()
+        self._retained = 0
+    
+    def rent(self, size: int) -> bytearray:
+        """Hand out a buffer of at least size bytes, reusing a returned one when possible"""
+        try:
+            buf = self._free.pop()
+        except IndexError:
+            return bytearray(size)
+        self._retained -= len(buf)
+        return buf if len(buf) >= size else bytearray(size)
+    
+    def release(self, buf: bytearray):
+        """Return a buffer to the pool once nothing references it any more"""
+        if self._retained + len(buf) <= self.max_bytes:
+            self._free.append(buf)
+            self._retained += len(buf)
+
+
+_buffer_pool = _BufferPool()
+
 
 class TransferSession:
     """Manages a single file transfer session with metadata"""
-    def __init__(self, filename: str, filesize: int, num_parts: int, ports: List[int], checksum: str = ""):
+    def __init__(self, filename: str, filesize: int, num_parts: int, port: int,
+                 checksum: Optional[str] = ""):
         self.filename = filename
         self.filesize = filesize
         self.num_parts = num_parts
-        self.ports = ports
+        self.port = port
         self.checksum = checksum
         self.progress = {i: 0 for i in range(num_parts)}
         self.start_time = None
         self.bytes_transferred = 0
+        # Set every PROGRESS_STEP bytes so watchers wake on progress instead of polling
+        self.progress_event = asyncio.Event()
+        self._last_signalled = 0
+    
+    def add_progress(self, chunk_id: int, nbytes: int):
+        """Record nbytes more transferred for a chunk and wake progress watchers"""
+        self.bytes_transferred += nbytes
+        self.progress[chunk_id] += nbytes
+        if self.bytes_transferred - self._last_signalled >= PROGRESS_STEP:
+            self._last_signalled = self.bytes_transferred
+            self.progress_event.set()
 
 
 class AirTransSender:
     """High-speed sender using asyncio for parallel TCP transfers"""
     
-    def __init__(self, filepath: str, num_parts: int = 8, base_port: int = 5001):
+    def __init__(self, filepath: str, num_parts: int = 8, port: int = 5001,
+                 compression: bool = False, checksum: Optional[str] = None):
         self.filepath = Path(filepath)
         self.num_parts = num_parts
-        self.base_port = base_port
-        self.ports = [base_port + i for i in range(num_parts)]
+        self.compression = compression
+        self.port = port
         self.filesize = self.filepath.stat().st_size
+        # Whole-file SHA-256 from the session metadata, if the caller has it;
+        # the send path itself only hashes chunks
+        self.checksum = checksum
+        self.chunk_hash = chunk_hash_algo()
+        self._ranges: List[Tuple[int, int]] = []
+        self._digests: List[asyncio.Future] = []
+        self._pending: set = set()
+        self._all_sent = None
+        self._mm = None
         self.session = None
-        
-    async def send_chunk(self, chunk_data: bytes, port: int, chunk_id: int) -> Tuple[int, float]:
-        """Send a single chunk over TCP on specified port"""
-        server = await asyncio.start_server(
-            lambda r, w: self._handle_client(r, w, chunk_data, chunk_id),
-            '0.0.0.0', port
-        )
-        
-        addr = server.sockets[0].getsockname()
-        logger.info(f"Chunk {chunk_id} server started on {addr}")
-        
-        async with server:
-            await server.serve_forever()
     
-    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, 
-                            chunk_data: bytes, chunk_id: int):
-        """Handle incoming connection and send chunk data"""
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Handle incoming connection: read the requested chunk id, then send that chunk"""
         addr = writer.get_extra_info('peername')
-        logger.info(f"Client connected from {addr} for chunk {chunk_id}")
+        sock = writer.get_extra_info('socket')
+        _tune_socket(sock, sndbuf=config.SOCKET_BUFFER_SIZE)
+        chunk_id = None
         
         try:
-            # Send chunk metadata first
-            metadata = {
-                'chunk_id': chunk_id,
-                'size': len(chunk_data),
-                'checksum': hashlib.sha256(chunk_data).hexdigest()
-            }
-            packed_meta = msgpack.packb(metadata)
-            writer.write(len(packed_meta).to_bytes(4, 'big'))
-            writer.write(packed_meta)
-            await writer.drain()
+            # The receiver opens every connection with the chunk id it wants and
+            # the block size it picked for the link
+            chunk_id, block_size = REQUEST_FRAME.unpack(await reader.readexactly(REQUEST_FRAME.size))
+            if chunk_id >= self.num_parts:
+                raise ValueError(f"Invalid chunk id {chunk_id} from {addr}")
+            offset, size = self._ranges[chunk_id]
+            logger.info(f"Client connected from {addr} for chunk {chunk_id}")
+            
+            header = CHUNK_HEADER.pack(chunk_id, size)
+            
+            # Raise the high-water mark so buffered writes (and the sendfile
+            # fallback) are not paused every 64KB for an event-loop round-trip.
+            # No explicit drain: sendfile flushes the header before it starts.
+            # Two blocks of headroom keep a BDP-sized block from stalling on drain.
+            writer.transport.set_write_buffer_limits(high=max(16 * 1024 * 1024, 2 * block_size))
+            _set_cork(sock, True)
+            writer.write(header)
             
-            # Send chunk data in blocks
-            block_size = 1024 * 1024  # 1MB blocks
+            loop = asyncio.get_running_loop()
             start_time = time.time()
             
-            for i in range(0, len(chunk_data), block_size):
-                block = chunk_data[i:i + block_size]
-                writer.write(block)
-                await writer.drain()
-                
-                self.session.bytes_transferred += len(block)
-                self.session.progress[chunk_id] = i + len(block)
-                
+            sent = 0
+            if self.compression:
+                sent = await self._send_compressed(writer, offset, size, block_size)
+            elif size:
+                # Send chunk data straight from the page cache to the socket.
+                # Each connection gets its own file object since sendfile seeks it.
+                with open(self.filepath, 'rb') as f:
+                    _advise_sequential(f.fileno(), offset, size)
+                    try:
+                        sent = await loop.sendfile(writer.transport, f, offset, size)
+                    except (AttributeError, NotImplementedError):
+                        # Event loops without sendfile (uvloop) read and write block by block
+                        sent = await self._send_pread(writer, f.fileno(), offset, size, block_size)
+            
+            # Send the digest once this chunk's hasher has finished, then
+            # flush the final partial segment
+            writer.write(CHUNK_TRAILER.pack(bytes.fromhex(await self._digests[chunk_id])))
+            _set_cork(sock, False)
+            self.session.add_progress(chunk_id, sent)
+            
             elapsed = time.time() - start_time
-            speed_mbps = (len(chunk_data) / elapsed) / (1024 * 1024)
-            logger.info(f"Chunk {chunk_id} sent: {len(chunk_data)} bytes in {elapsed:.2f}s ({speed_mbps:.2f} MB/s)")
+            speed_mbps = (sent / elapsed) / (1024 * 1024) if elapsed else 0.0
+            logger.info(f"Chunk {chunk_id} sent: {sent} bytes in {elapsed:.2f}s ({speed_mbps:.2f} MB/s)")
             
             writer.close()
             await writer.wait_closed()
             
+            # Finish once every chunk has been delivered
+            self._pending.discard(chunk_id)
+            if not self._pending:
+                self._all_sent.set()
+            
         except Exception as e:
             logger.error(f"Error sending chunk {chunk_id}: {e}")
+            writer.close()
+    
+    async def _send_pread(self, writer: asyncio.StreamWriter, fd: int, offset: int, size: int,
+                          block_size: int) -> int:
+        """Write a chunk block by block, reading each block at its offset with pread"""
+        block_size = min(max(block_size, config.BUFFER_SIZE), config.MAX_BLOCK_SIZE)
+        sent = 0
+        
+        for start in range(offset, offset + size, block_size):
+            block = await asyncio.to_thread(os.pread, fd, min(block_size, offset + size - start), start)
+            if not block:
+                break
+            writer.write(block)
+            await writer.drain()
+            sent += len(block)
+        
+        return sent
+    
+    async def _send_compressed(self, writer: asyncio.StreamWriter, offset: int, size: int,
+                               block_size: int) -> int:
+        """Stream a chunk as a single LZ4 frame, compressing block by block from the mapping"""
+        block_size = min(max(block_size, config.BUFFER_SIZE), config.MAX_BLOCK_SIZE)
+        compressor = lz4.frame.LZ4FrameCompressor()
+        writer.write(compressor.begin())
+        
+        for start in range(offset, offset + size, block_size):
+            end = min(start + block_size, offset + size)
+            # lz4 releases the GIL, so parallel chunks compress on separate cores
+            writer.write(await asyncio.to_thread(self._compress_block, compressor, start, end))
+            await writer.drain()
+        
+        writer.write(compressor.flush())
+        await writer.drain()
+        return size
+    
+    def _compress_block(self, compressor: lz4.frame.LZ4FrameCompressor, start: int, end: int) -> bytes:
+        """Compress a byte range of the mapped file (runs in a worker thread)"""
+        with memoryview(self._mm) as view:
+            return compressor.compress(view[start:end])
+    
+    async def _hasher(self, queue: asyncio.Queue):
+        """Hash queued chunks on a worker thread until the queue is empty"""
+        while not queue.empty():
+            chunk_id = queue.get_nowait()
+            digest = self._digests[chunk_id]
+            try:
+                digest.set_result(await asyncio.to_thread(self._hash_chunk, *self._ranges[chunk_id]))
+            except Exception as e:
+                digest.set_exception(e)
+    
+    def _hash_chunk(self, offset: int, size: int) -> str:
+        """Hash a byte range of the mapped file (runs in a worker thread)"""
+        with memoryview(self._mm) as view:
+            return new_chunk_hash(self.chunk_hash, view[offset:offset + size]).hexdigest()
     
     async def send_file(self) -> Dict:
-        """Main method to split and send file over multiple ports"""
+        """Main method to split and send file over parallel connections to one port"""
         logger.info(f"Starting transfer of {self.filepath.name} ({self.filesize} bytes)")
         
-        # Read and split file
-        with open(self.filepath, 'rb') as f:
-            file_data = f.read()
+        # Split file into (offset, size) ranges; data is never loaded into memory
+        self._ranges = chunk_ranges(self.filesize, self.num_parts)
         
-        file_checksum = hashlib.sha256(file_data).hexdigest()
-        chunk_size = self.filesize // self.num_parts
-        chunks = []
+        # Map the file read-only; memoryview slices of the mapping are views, not copies
+        with open(self.filepath, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.filesize else b''
         
-        for i in range(self.num_parts):
-            start = i * chunk_size
-            end = start + chunk_size if i < self.num_parts - 1 else self.filesize
-            chunks.append(file_data[start:end])
+        # Hash chunks in chunk order on one worker thread per core (hashlib
+        # releases the GIL). Digests go out after the data, so hashing overlaps
+        # with sending instead of holding it back.
+        loop = asyncio.get_running_loop()
+        self._digests = [loop.create_future() for _ in self._ranges]
+        hash_queue = asyncio.Queue()
+        for chunk_id in range(self.num_parts):
+            hash_queue.put_nowait(chunk_id)
+        hashers = [
+            asyncio.create_task(self._hasher(hash_queue))
+            for _ in range(min(os.cpu_count() or 1, self.num_parts))
+        ]
         
         self.session = TransferSession(
-            self.filepath.name, self.filesize, self.num_parts, self.ports, file_checksum
+            self.filepath.name, self.filesize, self.num_parts, self.port, self.checksum
         )
         self.session.start_time = time.time()
+        self._pending = set(range(self.num_parts))
+        self._all_sent = asyncio.Event()
         
-        # Create server tasks for each chunk
-        tasks = [
-            asyncio.create_task(self.send_chunk(chunk, port, i))
-            for i, (chunk, port) in enumerate(zip(chunks, self.ports))
-        ]
+        # A single listener serves every chunk; each connection says which one it wants
+        server = await asyncio.start_server(
+            self._handle_client, '0.0.0.0', self.port, backlog=max(self.num_parts, 100)
+        )
+        logger.info(f"Transfer server started on {server.sockets[0].getsockname()}")
         
         # Wait for all transfers to complete (with timeout)
         try:
-            await asyncio.wait_for(asyncio.gather(*tasks), timeout=300)
+            # Session checksum is a tree hash over the chunk checksums, so it never
+            # needs a separate pass over the whole file
+            chunk_checksums = await asyncio.gather(*self._digests)
+            tree_checksum = ChecksumManager.calculate_tree_checksum(chunk_checksums)
+            
+            await asyncio.wait_for(self._all_sent.wait(), timeout=300)
         except asyncio.TimeoutError:
             logger.error("Transfer timed out")
+        finally:
+            server.close()
+            await server.wait_closed()
+            for hasher in hashers:
+                hasher.cancel()
+            await asyncio.gather(*hashers, return_exceptions=True)
+            if isinstance(self._mm, mmap.mmap):
+                self._mm.close()
         
         elapsed = time.time() - self.session.start_time
         avg_speed = (self.filesize / elapsed) / (1024 * 1024)
@@ -132,9 +462,14 @@ class AirTransSender:
         return {
             'filename': self.filepath.name,
             'filesize': self.filesize,
-            'ports': self.ports,
+            'port': self.port,
             'num_parts': self.num_parts,
-            'checksum': file_checksum,
+            'chunk_offsets': [start for start, _ in self._ranges],
+            'checksum': self.checksum,
+            'chunk_hash': self.chunk_hash,
+            'chunk_checksums': chunk_checksums,
+            'tree_checksum': tree_checksum,
+            'compression': self.compression,
             'elapsed': elapsed,
             'avg_speed_mbps': avg_speed
         }
@@ -147,87 +482,272 @@ class AirTransReceiver:
         self.metadata = metadata
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
-        self.chunks = {}
+        self.output_path = self.output_dir / metadata['filename']
+        self._out_fd = None
+        self._chunk_checksums: List[str] = [''] * metadata['num_parts']
+        # Metadata without chunk_offsets (e.g. from a QR code) gets the
+        # sender's boundaries from the same chunk_ranges split
+        self._chunk_offsets: List[int] = metadata.get('chunk_offsets') or [
+            offset for offset, _ in chunk_ranges(metadata['filesize'], metadata['num_parts'])
+        ]
+        # Metadata from before chunk_hash existed always meant SHA-256
+        self._chunk_hash = metadata.get('chunk_hash', 'sha256')
+        self._digest_size = len(new_chunk_hash(self._chunk_hash).digest())
+        self._bandwidth_bps = _link_speed_bps()
+        # Checksums computed over the received data, set by receive_file
+        self.tree_checksum = None
+        self.file_checksum = None
         self.session = TransferSession(
             metadata['filename'],
             metadata['filesize'],
             metadata['num_parts'],
-            metadata['ports'],
-            metadata['checksum']
+            metadata['port'],
+            metadata.get('checksum')
         )
     
     async def receive_chunk(self, ip: str, port: int, chunk_id: int):
         """Receive a single chunk from sender"""
+        loop = asyncio.get_running_loop()
+        family, type_, proto, _, addr = (
+            await loop.getaddrinfo(ip, port, type=socket.SOCK_STREAM)
+        )[0]
+        sock = socket.socket(family, type_, proto)
+        sock.setblocking(False)
+        # Set before connecting so the window scale is negotiated for it
+        _tune_socket(sock, rcvbuf=config.SOCKET_BUFFER_SIZE)
+        
         try:
-            reader, writer = await asyncio.open_connection(ip, port)
-            logger.info(f"Connected to {ip}:{port} for chunk {chunk_id}")
+            # The TCP handshake doubles as an RTT sample for sizing blocks to the link
+            connect_start = time.perf_counter()
+            await loop.sock_connect(sock, addr)
+            rtt = time.perf_counter() - connect_start
+            block_size = _block_size_for(rtt, self._bandwidth_bps, self.metadata['num_parts'])
+            logger.info(f"Connected to {ip}:{port} for chunk {chunk_id} "
+                        f"(rtt {rtt * 1000:.2f} ms, block {block_size} bytes)")
             
-            # Read metadata
-            meta_len = int.from_bytes(await reader.readexactly(4), 'big')
-            meta_data = await reader.readexactly(meta_len)
-            metadata = msgpack.unpackb(meta_data)
+            # Tell the sender which chunk this connection carries
+            await loop.sock_sendall(sock, REQUEST_FRAME.pack(chunk_id, block_size))
             
-            chunk_size = metadata['size']
-            chunk_checksum = metadata['checksum']
+            # Read the fixed-size chunk header
+            header_id, chunk_size = CHUNK_HEADER.unpack(
+                await _recv_exactly(loop, sock, CHUNK_HEADER.size)
+            )
+            if header_id != chunk_id:
+                raise ValueError(f"Sender answered chunk {header_id}, expected {chunk_id}")
             
-            # Read chunk data
-            chunk_data = bytearray()
-            bytes_received = 0
+            chunk_offset = self._chunk_offsets[chunk_id]
             start_time = time.time()
             
-            while bytes_received < chunk_size:
-                block = await reader.read(1024 * 1024)  # 1MB blocks
-                if not block:
-                    break
-                chunk_data.extend(block)
-                bytes_received += len(block)
-                self.session.bytes_transferred += len(block)
-                self.session.progress[chunk_id] = bytes_received
+            trailer = b''
+            if self.metadata.get('compression'):
+                bytes_received, received_checksum, trailer = await self._read_compressed_chunk(
+                    loop, sock, chunk_id, chunk_offset, block_size
+                )
+            elif hasattr(os, 'splice'):
+                # Linux: move the data socket -> pipe -> file without copying it
+                # through userspace, then hash it back out of the page cache.
+                # Write-behind, in-flight hashing and pooled buffers belong to
+                # the userspace paths below; this one has no buffers to overlap.
+                bytes_received = await self._splice_chunk(loop, sock, chunk_id, chunk_offset, chunk_size)
+                received_checksum = await asyncio.to_thread(
+                    _checksum_range, self._out_fd, chunk_offset, bytes_received, self._chunk_hash
+                )
+            else:
+                bytes_received, received_checksum = await self._read_chunk(
+                    loop, sock, chunk_id, chunk_offset, chunk_size, block_size
+                )
             
-            # Verify checksum
-            received_checksum = hashlib.sha256(chunk_data).hexdigest()
-            if received_checksum != chunk_checksum:
-                raise ValueError(f"Chunk {chunk_id} checksum mismatch!")
+            # The digest trailer follows the data (part of it may have been read
+            # past the end of an LZ4 frame)
+            trailer += await _recv_exactly(loop, sock, CHUNK_TRAILER.size - len(trailer))
+            chunk_checksum = CHUNK_TRAILER.unpack(trailer)[0][:self._digest_size].hex()
             
-            self.chunks[chunk_id] = bytes(chunk_data)
+            # Verify checksum against the chunk trailer and, when the session
+            # metadata lists per-chunk checksums, against the published one too
+            expected = self.metadata.get('chunk_checksums') or []
+            if received_checksum != chunk_checksum or (
+                    expected and received_checksum != expected[chunk_id]):
+                raise ValueError(f"Chunk {chunk_id} checksum mismatch!")
+            self._chunk_checksums[chunk_id] = received_checksum
             
             elapsed = time.time() - start_time
-            speed_mbps = (chunk_size / elapsed) / (1024 * 1024)
+            speed_mbps = (chunk_size / elapsed) / (1024 * 1024) if elapsed else 0.0
             logger.info(f"Chunk {chunk_id} received: {chunk_size} bytes in {elapsed:.2f}s ({speed_mbps:.2f} MB/s)")
             
-            writer.close()
-            await writer.wait_closed()
-            
         except Exception as e:
             logger.error(f"Error receiving chunk {chunk_id}: {e}")
             raise
+        finally:
+            sock.close()
+    
+    async def _splice_chunk(self, loop: asyncio.AbstractEventLoop, sock: socket.socket,
+                            chunk_id: int, offset: int, size: int) -> int:
+        """
+        Splice chunk data from the socket into the output file inside the kernel.
+        
+        The socket -> pipe half runs on the event loop; each pipe-full is
+        drained into the file on a worker thread, so disk writes never block
+        the loop while other chunks are receiving.
+        """
+        pipe_r, pipe_w = os.pipe()
+        try:
+            try:
+                pipe_size = fcntl.fcntl(pipe_w, fcntl.F_SETPIPE_SZ, 1024 * 1024)
+            except (AttributeError, OSError):  # fcntl or F_SETPIPE_SZ missing, or refused
+                pipe_size = 64 * 1024  # Default pipe capacity
+            
+            bytes_received = 0
+            buffered = 0  # Bytes in the pipe, not yet written to the file
+            while bytes_received < size:
+                try:
+                    n = os.splice(sock.fileno(), pipe_w,
+                                  min(size - bytes_received, pipe_size - buffered),
+                                  flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    # Socket is dry: write out what arrived before waiting for more
+                    if buffered:
+                        await self._drain_pipe(pipe_r, chunk_id, offset + bytes_received - buffered, buffered)
+                        buffered = 0
+                    else:
+                        await _wait_readable(loop, sock)
+                    continue
+                if not n:
+                    break
+                
+                bytes_received += n
+                buffered += n
+                if buffered >= pipe_size or bytes_received >= size:
+                    await self._drain_pipe(pipe_r, chunk_id, offset + bytes_received - buffered, buffered)
+                    buffered = 0
+            
+            if buffered:
+                await self._drain_pipe(pipe_r, chunk_id, offset + bytes_received - buffered, buffered)
+        finally:
+            os.close(pipe_r)
+            os.close(pipe_w)
+        
+        return bytes_received
+    
+    async def _drain_pipe(self, pipe_r: int, chunk_id: int, offset: int, count: int):
+        """Splice count bytes from the pipe into the output file at offset on a worker thread"""
+        await asyncio.to_thread(_splice_to_file, pipe_r, self._out_fd, offset, count)
+        self.session.add_progress(chunk_id, count)
+    
+    async def _read_chunk(self, loop: asyncio.AbstractEventLoop, sock: socket.socket,
+                          chunk_id: int, offset: int, size: int, block_size: int) -> Tuple[int, str]:
+        """Read chunk data block by block, hashing it and writing it behind the socket reads"""
+        hash_obj = new_chunk_hash(self._chunk_hash)
+        writes = _WriteBehind(self._out_fd)
+        # One buffer per in-flight write plus the one being filled
+        block_size = min(block_size, size)
+        buffers = [_buffer_pool.rent(block_size) for _ in range(writes.depth + 1)]
+        hashing = None
+        bytes_received = 0
+        blocks = 0
+        
+        try:
+            while bytes_received < size:
+                view = memoryview(buffers[blocks % len(buffers)])[:min(block_size, size - bytes_received)]
+                blocks += 1
+                n = await _recv_into(loop, sock, view)
+                if not n:
+                    break
+                # Hash on a worker thread so hashing overlaps the next socket read;
+                # updates stay in order since each waits for the previous one
+                if hashing:
+                    await hashing
+                hashing = asyncio.ensure_future(asyncio.to_thread(hash_obj.update, view[:n]))
+                await writes.submit(view[:n], offset + bytes_received)
+                
+                bytes_received += n
+                self.session.add_progress(chunk_id, n)
+        finally:
+            if hashing:
+                await hashing
+            await writes.flush()
+            for buf in buffers:
+                _buffer_pool.release(buf)
+        
+        return bytes_received, hash_obj.hexdigest()
+    
+    async def _read_compressed_chunk(self, loop: asyncio.AbstractEventLoop, sock: socket.socket,
+                                     chunk_id: int, offset: int, block_size: int) -> Tuple[int, str, bytes]:
+        """Decompress an LZ4-framed chunk as it arrives, returning any bytes read past the frame"""
+        decompressor = lz4.frame.LZ4FrameDecompressor()
+        hash_obj = new_chunk_hash(self._chunk_hash)
+        writes = _WriteBehind(self._out_fd)
+        buf = _buffer_pool.rent(block_size)
+        view = memoryview(buf)[:block_size]
+        hashing = None
+        bytes_received = 0
+        
+        try:
+            while not decompressor.eof:
+                n = await loop.sock_recv_into(sock, view)
+                if not n:
+                    break
+                data = decompressor.decompress(view[:n])
+                if hashing:
+                    await hashing
+                hashing = asyncio.ensure_future(asyncio.to_thread(hash_obj.update, data))
+                await writes.submit(data, offset + bytes_received)
+                
+                bytes_received += len(data)
+                self.session.add_progress(chunk_id, len(data))
+        finally:
+            if hashing:
+                await hashing
+            await writes.flush()
+            _buffer_pool.release(buf)
+        
+        return bytes_received, hash_obj.hexdigest(), decompressor.unused_data
     
     async def receive_file(self, sender_ip: str) -> str:
         """Main method to receive all chunks and reassemble file"""
         logger.info(f"Starting download from {sender_ip}")
         self.session.start_time = time.time()
         
+        # Size the output file up front; chunks are written straight into it
+        output_path = self.output_path
+        self._out_fd = os.open(output_path, os.O_CREAT | os.O_RDWR | os.O_TRUNC, 0o644)
+        _preallocate(self._out_fd, self.metadata['filesize'])
+        
         # Create receive tasks for all chunks
         tasks = [
-            asyncio.create_task(self.receive_chunk(sender_ip, port, i))
-            for i, port in enumerate(self.metadata['ports'])
+            asyncio.create_task(self.receive_chunk(sender_ip, self.metadata['port'], i))
+            for i in range(self.metadata['num_parts'])
         ]
         
         # Wait for all downloads to complete
-        await asyncio.gather(*tasks)
-        
-        # Reassemble file
-        output_path = self.output_dir / self.metadata['filename']
-        with open(output_path, 'wb') as f:
-            for i in range(self.metadata['num_parts']):
-                f.write(self.chunks[i])
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the remaining chunks before their file descriptor goes away
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            os.close(self._out_fd)
         
-        # Verify final file
-        with open(output_path, 'rb') as f:
-            file_checksum = hashlib.sha256(f.read()).hexdigest()
+        # Every chunk is already verified, so the file is checked through the
+        # tree hash of those checksums instead of re-reading it from disk
+        tree_checksum = self.metadata.get('tree_checksum')
+        self.tree_checksum = ChecksumManager.calculate_tree_checksum(self._chunk_checksums)
+        if tree_checksum and self.tree_checksum != tree_checksum:
+            raise ValueError("Final tree checksum mismatch!")
         
-        if file_checksum != self.metadata['checksum']:
-            raise ValueError("Final file checksum mismatch!")
+        # A tree over CRCs or xxh3 digests only catches accidental corruption,
+        # so SHA-256 stays the end-to-end check for those chunk hashes
+        if (config.VERIFY_FULL_HASH or not tree_checksum
+                or self._chunk_hash not in CRYPTOGRAPHIC_CHUNK_HASHES):
+            if not self.metadata.get('checksum'):
+                raise ValueError("Metadata has no file checksum to verify against")
+            self.file_checksum = await asyncio.to_thread(
+                ChecksumManager.calculate_file_checksum, str(output_path)
+            )
+            if self.file_checksum != self.metadata['checksum']:
+                raise ValueError("Final file checksum mismatch!")
         
         elapsed = time.time() - self.session.start_time
         avg_speed = (self.metadata['filesize'] / elapsed) / (1024 * 1024)
@@ -245,8 +765,8 @@ async def send_mode(filepath: str, num_parts: int = 8):
     metadata = await sender.send_file()
     print(f"\n✅ Transfer metadata:")
     print(f"   Filename: {metadata['filename']}")
-    print(f"   Ports: {metadata['ports']}")
-    print(f"   Checksum: {metadata['checksum']}")
+    print(f"   Port: {metadata['port']}")
+    print(f"   Tree checksum: {metadata['tree_checksum']}")
     print(f"   Speed: {metadata['avg_speed_mbps']:.2f} MB/s")
     return metadata
 
@@ -268,6 +788,7 @@ if __name__ == "__main__":
         sys.exit(1)
     
     mode = sys.argv[1]
+    install_event_loop()
     
     if mode == "send":
         filepath = sys.argv[2]
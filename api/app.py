@@ -2,45 +2,236 @@
 AirTrans Flask API - REST endpoints for QR generation, session management, and transfer control
 """
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request
 from flask_cors import CORS
-import qrcode
-import json
+import orjson
+import os
 import uuid
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Optional, Tuple
 import io
-import socket
 import logging
 
-from api.utils import TransferMetadata, ChecksumManager, format_size
+try:
+    import segno  # Much faster mask selection than python-qrcode
+except ImportError:
+    segno = None
+
+try:
+    import cv2  # Native grayscale decode + QR detection for uploads
+    import numpy as np
+except ImportError:
+    cv2 = None
+
+try:
+    from pyzbar.pyzbar import decode as zbar_decode
+except ImportError:
+    zbar_decode = None
+
+from api.sessions import create_session_store
+from api.utils import TransferMetadata, ChecksumManager, format_size, get_local_ip
+from config.settings import config
 
 app = Flask(__name__)
 CORS(app)
+# Bounds body parsing time; QR screenshot uploads are the largest bodies
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# In-memory session storage (use Redis in production)
-sessions: Dict[str, Dict] = {}
+# Session storage (Redis when AIRTRANS_REDIS_URL is set, otherwise in memory)
+sessions = create_session_store()
+config.ensure_dirs()
+
+# Session setup and file verification hash whole files, so they run here
+# rather than in a request worker. Jobs are per-process; their results are
+# also written to the session store.
+_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="airtrans")
+_verify_jobs: "OrderedDict[str, Future]" = OrderedDict()
+_verify_jobs_lock = threading.Lock()
+
+
+def json_response(obj, status: int = 200):
+    """Serialize a response body with orjson"""
+    return app.response_class(
+        orjson.dumps(obj),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+def read_json() -> Optional[Dict]:
+    """Parse the request body with orjson; None if it is not a JSON object"""
+    try:
+        data = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def render_qr_png(metadata: Dict) -> bytes:
+    """Render transfer metadata as a QR code PNG (segno when installed, else python-qrcode)"""
+    # Receivers derive chunk_offsets with chunk_ranges; leaving them out keeps
+    # the payload of a MAX_PORTS-part transfer within a version 40 QR code
+    qr_data = orjson.dumps({key: value for key, value in metadata.items() if key != 'chunk_offsets'})
+    img_buffer = io.BytesIO()
+    
+    if segno is not None:
+        qr = segno.make(qr_data, error='l', boost_error=False, micro=False)
+        # Tiny image served over a LAN: favour encode speed over PNG size
+        qr.save(img_buffer, kind='png', scale=10, border=4, compresslevel=1)
+        return img_buffer.getvalue()
+    
+    import qrcode
+    qr = qrcode.QRCode(
+        version=None,  # Auto-size
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        box_size=10,
+        border=4,
+    )
+    qr.add_data(qr_data)
+    qr.make(fit=True)
+    
+    img = qr.make_image(fill_color="black", back_color="white")
+    img.save(img_buffer, format='PNG', compress_level=1, optimize=False)
+    return img_buffer.getvalue()
+
+
+def render_qr_entry(metadata: Dict) -> Tuple[bytes, str]:
+    """Render a session's QR code PNG with its ETag, computed once for caching"""
+    png = render_qr_png(metadata)
+    return png, hashlib.sha256(png).hexdigest()
+
+
+def decode_qr_image(data: bytes) -> Optional[bytes]:
+    """
+    Decode the first QR code in an encoded image, or return None.
+    
+    OpenCV decodes straight to grayscale and detects natively; pyzbar is
+    only consulted when it finds nothing (or OpenCV is not installed).
+    """
+    if cv2 is None and zbar_decode is None:
+        raise ImportError("no QR decoder available")
+    
+    img = None
+    if cv2 is not None:
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if img is None:
+            return None
+        qr_data, _, _ = cv2.QRCodeDetector().detectAndDecode(img)
+        if qr_data:
+            return qr_data.encode()
+    
+    if zbar_decode is None:
+        return None
+    if img is None:
+        from PIL import Image
+        img = Image.open(io.BytesIO(data)).convert('L')
+    decoded_objects = zbar_decode(img)
+    return decoded_objects[0].data if decoded_objects else None
+
+
+def _get_ready_session(session_id: str):
+    """Return (session, None), or (None, error response) while it is missing or being prepared"""
+    session = sessions.get(session_id)
+    if session is None:
+        return None, json_response({'error': 'Session not found'}, 404)
+    
+    if session['status'] == 'preparing':
+        response = json_response({'error': 'Session is still being prepared', 'status': 'preparing'}, 425)
+        response.headers['Retry-After'] = '1'
+        return None, response
+    
+    if session['status'] == 'error':
+        return None, json_response({'error': f"Session setup failed: {session['error']}"}, 500)
+    
+    return session, None
 
 
-def get_local_ip() -> str:
-    """Get local IP address"""
+def _build_session(session_id: str, filepath: Path, num_parts: int, port: int, use_compression: bool):
+    """Compute metadata (including the file checksum) and the QR code for a new session"""
     try:
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        ip = s.getsockname()[0]
-        s.close()
-        return ip
-    except Exception:
-        return "127.0.0.1"
+        metadata = TransferMetadata.create_metadata(
+            str(filepath), get_local_ip(), port, num_parts, use_compression
+        )
+        qr_entry = render_qr_entry(metadata)
+    except Exception as e:
+        logger.error(f"Error preparing session {session_id}: {e}")
+        sessions.update(session_id, status='error', error=str(e))
+        return
+    
+    # Don't resurrect a session deleted while it was being prepared
+    if sessions.get(session_id) is None:
+        return
+    
+    sessions.put(session_id, {
+        'metadata': metadata,
+        'status': 'pending',
+        'created_at': None,
+        'progress': new_progress(num_parts),
+        'filepath': str(filepath)
+    })
+    sessions.set_qr(session_id, *qr_entry)
+    
+    logger.info(f"Session {session_id} ready for {filepath.name}")
+
+
+def _verify_in_background(session_id: str, output_path: str, expected_checksum: str) -> str:
+    """Queue a full-file checksum check and return its job id"""
+    job_id = str(uuid.uuid4())
+    future = _executor.submit(ChecksumManager.verify_file, output_path, expected_checksum)
+    
+    def _record(fut: Future):
+        match = not fut.cancelled() and fut.exception() is None and fut.result()
+        sessions.update(session_id, status='completed' if match else 'failed')
+    
+    with _verify_jobs_lock:
+        _verify_jobs[job_id] = future
+        # Forget the oldest finished jobs beyond the session cap
+        while len(_verify_jobs) > config.MAX_SESSIONS:
+            oldest_id, oldest = next(iter(_verify_jobs.items()))
+            if not oldest.done():
+                break
+            del _verify_jobs[oldest_id]
+    
+    future.add_done_callback(_record)
+    return job_id
+
+
+def new_progress(num_parts: int) -> array:
+    """Per-chunk byte counters, indexed by chunk id"""
+    return array('Q', [0]) * num_parts
+
+
+def _valid_progress(session: Dict, chunk_id, bytes_transferred) -> bool:
+    """Check a progress update refers to an existing chunk and a byte count"""
+    return (isinstance(chunk_id, int) and 0 <= chunk_id < session['metadata']['num_parts']
+            and isinstance(bytes_transferred, int) and bytes_transferred >= 0)
+
+
+def _refresh_transfer_status(session_id: str):
+    """Mark a session completed once all chunks are done, otherwise transferring"""
+    session = sessions.get(session_id)
+    if session is None:
+        return  # Expired or deleted since the caller looked it up
+    total_transferred = sum(session['progress'])
+    
+    if total_transferred >= session['metadata']['filesize']:
+        sessions.update(session_id, status='completed')
+    else:
+        sessions.update(session_id, status='transferring')
 
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return json_response({
         'status': 'healthy',
         'service': 'AirTrans API',
         'version': '1.0'
@@ -56,68 +247,63 @@ def create_session():
     {
         "filepath": "/path/to/file.mp4",
         "num_parts": 8,
-        "base_port": 5001,
+        "port": 5001,
         "compression": false
     }
     
-    Returns:
+    Returns 202 while metadata and the QR code are computed in the
+    background; /session/<id> and /qr/<id> answer 425 until it is ready.
     {
         "session_id": "uuid",
-        "metadata": {...},
+        "status": "preparing",
         "qr_code_url": "/qr/<session_id>"
     }
     """
     try:
-        data = request.get_json()
+        data = read_json()
+        if data is None:
+            return json_response({'error': 'Request body must be a JSON object'}, 400)
         
         # Validate input
         if 'filepath' not in data:
-            return jsonify({'error': 'filepath is required'}), 400
+            return json_response({'error': 'filepath is required'}, 400)
         
         filepath = Path(data['filepath'])
         if not filepath.exists():
-            return jsonify({'error': f'File not found: {filepath}'}), 404
+            return json_response({'error': f'File not found: {filepath}'}, 404)
         
         # Extract parameters
         num_parts = data.get('num_parts', 8)
-        base_port = data.get('base_port', 5001)
+        port = data.get('port', 5001)
         use_compression = data.get('compression', False)
-        
-        # Generate ports
-        ports = [base_port + i for i in range(num_parts)]
-        
-        # Get local IP
-        ip = get_local_ip()
-        
-        # Create metadata
-        metadata = TransferMetadata.create_metadata(
-            str(filepath), ip, ports, num_parts, use_compression
-        )
+        filesize = filepath.stat().st_size
         
         # Generate session ID
         session_id = str(uuid.uuid4())
         
-        # Store session
-        sessions[session_id] = {
-            'metadata': metadata,
-            'status': 'pending',
+        # Placeholder until _build_session has hashed the file; metadata
+        # never changes after that, so the QR code is rendered there once
+        sessions.put(session_id, {
+            'metadata': {'filename': filepath.name, 'filesize': filesize, 'num_parts': num_parts},
+            'status': 'preparing',
             'created_at': None,
-            'progress': {i: 0 for i in range(num_parts)},
+            'progress': new_progress(num_parts),
             'filepath': str(filepath)
-        }
+        })
+        _executor.submit(_build_session, session_id, filepath, num_parts, port, use_compression)
         
         logger.info(f"Created session {session_id} for {filepath.name}")
         
-        return jsonify({
+        return json_response({
             'session_id': session_id,
-            'metadata': metadata,
+            'status': 'preparing',
             'qr_code_url': f'/qr/{session_id}',
-            'filesize_human': format_size(metadata['filesize'])
-        }), 201
+            'filesize_human': format_size(filesize)
+        }, 202)
         
     except Exception as e:
         logger.error(f"Error creating session: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 
 @app.route('/qr/<session_id>', methods=['GET'])
@@ -127,37 +313,29 @@ def generate_qr_code(session_id: str):
     
     Returns PNG image of QR code containing transfer metadata
     """
-    if session_id not in sessions:
-        return jsonify({'error': 'Session not found'}), 404
+    session, error = _get_ready_session(session_id)
+    if error is not None:
+        return error
     
     try:
-        session = sessions[session_id]
-        metadata = session['metadata']
-        
-        # Create QR code with metadata as JSON
-        qr_data = json.dumps(metadata)
-        
-        qr = qrcode.QRCode(
-            version=None,  # Auto-size
-            error_correction=qrcode.constants.ERROR_CORRECT_L,
-            box_size=10,
-            border=4,
-        )
-        qr.add_data(qr_data)
-        qr.make(fit=True)
-        
-        img = qr.make_image(fill_color="black", back_color="white")
-        
-        # Save to bytes buffer
-        img_buffer = io.BytesIO()
-        img.save(img_buffer, format='PNG')
-        img_buffer.seek(0)
-        
-        return send_file(img_buffer, mimetype='image/png')
+        qr_entry = sessions.get_qr(session_id)
+        if qr_entry is None:
+            qr_entry = render_qr_entry(session['metadata'])
+            sessions.set_qr(session_id, *qr_entry)
+        png, etag = qr_entry
+        
+        # A session's QR code never changes, so let clients cache it and
+        # revalidate with If-None-Match (answered 304 by make_conditional)
+        response = Response(png, mimetype='image/png')
+        response.set_etag(etag)
+        response.cache_control.public = True
+        response.cache_control.max_age = config.SESSION_TIMEOUT
+        response.cache_control.immutable = True
+        return response.make_conditional(request)
         
     except Exception as e:
         logger.error(f"Error generating QR code: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 
 @app.route('/join-session', methods=['POST'])
@@ -178,41 +356,43 @@ def join_session():
     }
     """
     try:
-        data = request.get_json()
+        data = read_json()
+        if data is None:
+            return json_response({'error': 'Request body must be a JSON object'}, 400)
         
         if 'metadata' not in data:
-            return jsonify({'error': 'metadata is required'}), 400
+            return json_response({'error': 'metadata is required'}, 400)
         
         metadata = data['metadata']
         
         # Validate metadata
         if not TransferMetadata.validate_metadata(metadata):
-            return jsonify({'error': 'Invalid metadata'}), 400
+            return json_response({'error': 'Invalid metadata'}, 400)
         
         # Create receiver session
         session_id = str(uuid.uuid4())
-        sessions[session_id] = {
+        sessions.put(session_id, {
             'metadata': metadata,
             'status': 'ready',
             'role': 'receiver',
-            'progress': {i: 0 for i in range(metadata['num_parts'])}
-        }
+            'progress': new_progress(metadata['num_parts'])
+        })
         
         logger.info(f"Receiver joined session {session_id}")
         
-        return jsonify({
+        return json_response({
             'session_id': session_id,
             'status': 'ready',
             'sender_ip': metadata['ip'],
-            'ports': metadata['ports'],
+            'port': metadata['port'],
             'filename': metadata['filename'],
             'filesize': metadata['filesize'],
             'instructions': f"Ready to receive {metadata['filename']} from {metadata['ip']}"
-        }), 200
+        }, 200)
         
     except Exception as e:
         logger.error(f"Error joining session: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 
 @app.route('/progress/<session_id>', methods=['GET'])
@@ -224,23 +404,23 @@ def get_progress(session_id: str):
     {
         "session_id": "uuid",
         "status": "transferring",
-        "progress": {...},
+        "progress": [bytes per chunk, ...],
         "total_transferred": 12345,
         "percentage": 45.2
     }
     """
-    if session_id not in sessions:
-        return jsonify({'error': 'Session not found'}), 404
+    session, error = _get_ready_session(session_id)
+    if error is not None:
+        return error
     
-    session = sessions[session_id]
     metadata = session['metadata']
-    total_transferred = sum(session['progress'].values())
+    total_transferred = sum(session['progress'])
     percentage = (total_transferred / metadata['filesize']) * 100
     
-    return jsonify({
+    return json_response({
         'session_id': session_id,
         'status': session['status'],
-        'progress': session['progress'],
+        'progress': session['progress'].tolist(),
         'total_transferred': total_transferred,
         'filesize': metadata['filesize'],
         'percentage': round(percentage, 2),
@@ -259,34 +439,80 @@ def update_progress(session_id: str):
         "bytes_transferred": 12345
     }
     """
-    if session_id not in sessions:
-        return jsonify({'error': 'Session not found'}), 404
+    session, error = _get_ready_session(session_id)
+    if error is not None:
+        return error
     
     try:
-        data = request.get_json()
+        data = read_json()
+        if data is None:
+            return json_response({'error': 'Request body must be a JSON object'}, 400)
         chunk_id = data.get('chunk_id')
         bytes_transferred = data.get('bytes_transferred')
         
         if chunk_id is None or bytes_transferred is None:
-            return jsonify({'error': 'chunk_id and bytes_transferred required'}), 400
+            return json_response({'error': 'chunk_id and bytes_transferred required'}, 400)
+        if not _valid_progress(session, chunk_id, bytes_transferred):
+            return json_response({'error': f'Invalid progress for chunk {chunk_id}'}, 400)
         
-        session = sessions[session_id]
-        session['progress'][chunk_id] = bytes_transferred
+        sessions.set_progress(session_id, {chunk_id: bytes_transferred})
+        _refresh_transfer_status(session_id)
         
-        # Check if all chunks complete
-        metadata = session['metadata']
-        total_transferred = sum(session['progress'].values())
+        return json_response({'status': 'updated'})
         
-        if total_transferred >= metadata['filesize']:
-            session['status'] = 'completed'
-        else:
-            session['status'] = 'transferring'
-        
-        return jsonify({'status': 'updated'})
+    except Exception as e:
+        logger.error(f"Error updating progress: {e}")
+        return json_response({'error': str(e)}, 500)
+
+
+@app.route('/update-progress-batch/<session_id>', methods=['POST'])
+def update_progress_batch(session_id: str):
+    """
+    Update progress for several chunks in one request
+    
+    Expected JSON body:
+    {
+        "updates": [
+            {"chunk_id": 0, "bytes_transferred": 12345},
+            {"chunk_id": 1, "bytes_transferred": 67890}
+        ]
+    }
+    """
+    session, error = _get_ready_session(session_id)
+    if error is not None:
+        return error
+    
+    try:
+        data = read_json()
+        if data is None:
+            return json_response({'error': 'Request body must be a JSON object'}, 400)
+        updates = data.get('updates')
+        
+        if not isinstance(updates, list):
+            return json_response({'error': 'updates list required'}, 400)
+        
+        progress = {}
+        for update in updates:
+            if not isinstance(update, dict):
+                return json_response({'error': 'Each update must be a JSON object'}, 400)
+            chunk_id = update.get('chunk_id')
+            bytes_transferred = update.get('bytes_transferred')
+            if chunk_id is None or bytes_transferred is None:
+                return json_response({'error': 'chunk_id and bytes_transferred required'}, 400)
+            if not _valid_progress(session, chunk_id, bytes_transferred):
+                return json_response({'error': f'Invalid progress for chunk {chunk_id}'}, 400)
+            progress[chunk_id] = bytes_transferred
+        
+        if progress:
+            sessions.set_progress(session_id, progress)
+            _refresh_transfer_status(session_id)
+        
+        return json_response({'status': 'updated', 'count': len(progress)})
         
     except Exception as e:
         logger.error(f"Error updating progress: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
+
 
 
 @app.route('/complete/<session_id>', methods=['POST'])
@@ -294,10 +520,11 @@ def complete_transfer(session_id: str):
     """
     Mark transfer as complete and verify integrity
     
-    Expected JSON body:
+    Expected JSON body (checksums are those the receiver computed):
     {
         "output_path": "/path/to/received/file",
-        "checksum": "sha256..."
+        "checksum": "sha256...",
+        "tree_checksum": "sha256..."
     }
     
     Returns:
@@ -305,36 +532,79 @@ def complete_transfer(session_id: str):
         "status": "verified",
         "checksum_match": true
     }
+    
+    With output_path the file is hashed in the background: responds
+    202 with a job_id to poll at /verify-status/<job_id>.
     """
-    if session_id not in sessions:
-        return jsonify({'error': 'Session not found'}), 404
+    session, error = _get_ready_session(session_id)
+    if error is not None:
+        return error
     
     try:
-        data = request.get_json()
+        data = read_json()
+        if data is None:
+            return json_response({'error': 'Request body must be a JSON object'}, 400)
         output_path = data.get('output_path')
         received_checksum = data.get('checksum')
+        received_tree_checksum = data.get('tree_checksum')
         
-        session = sessions[session_id]
         expected_checksum = session['metadata']['checksum']
+        expected_tree_checksum = session['metadata'].get('tree_checksum')
         
-        # Verify checksum if file path provided
-        checksum_match = None
+        # Hashing a whole file is slow: hand it off and let the client poll
         if output_path:
-            checksum_match = ChecksumManager.verify_file(output_path, expected_checksum)
-        elif received_checksum:
-            checksum_match = received_checksum == expected_checksum
-        
-        session['status'] = 'completed' if checksum_match else 'failed'
-        
-        return jsonify({
-            'status': session['status'],
+            sessions.update(session_id, status='verifying')
+            job_id = _verify_in_background(session_id, output_path, expected_checksum)
+            return json_response({
+                'status': 'verifying',
+                'job_id': job_id,
+                'expected_checksum': expected_checksum
+            }, 202)
+        
+        # Every checksum the receiver reports has to match
+        matches = []
+        if received_checksum:
+            matches.append(received_checksum == expected_checksum)
+        if received_tree_checksum and expected_tree_checksum:
+            matches.append(received_tree_checksum == expected_tree_checksum)
+        checksum_match = all(matches) if matches else None
+        
+        status = 'completed' if checksum_match else 'failed'
+        sessions.update(session_id, status=status)
+        
+        return json_response({
+            'status': status,
             'checksum_match': checksum_match,
-            'expected_checksum': expected_checksum
+            'expected_checksum': expected_checksum,
+            'expected_tree_checksum': expected_tree_checksum
         })
         
     except Exception as e:
         logger.error(f"Error completing transfer: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
+
+
+@app.route('/verify-status/<job_id>', methods=['GET'])
+def verify_status(job_id: str):
+    """Poll a background verification started by /complete"""
+    with _verify_jobs_lock:
+        future = _verify_jobs.get(job_id)
+    if future is None:
+        return json_response({'error': 'Verification job not found'}, 404)
+    
+    if not future.done():
+        return json_response({'job_id': job_id, 'status': 'verifying'})
+    
+    error = future.exception()
+    if error is not None:
+        return json_response({'job_id': job_id, 'status': 'failed', 'error': str(error)})
+    
+    checksum_match = future.result()
+    return json_response({
+        'job_id': job_id,
+        'status': 'completed' if checksum_match else 'failed',
+        'checksum_match': checksum_match
+    })
 
 
 @app.route('/sessions', methods=['GET'])
@@ -350,33 +620,32 @@ def list_sessions():
             'num_parts': session['metadata']['num_parts']
         })
     
-    return jsonify({'sessions': session_list, 'count': len(session_list)})
+    return json_response({'sessions': session_list, 'count': len(session_list)})
 
 
 @app.route('/session/<session_id>', methods=['DELETE'])
 def delete_session(session_id: str):
     """Delete a session"""
-    if session_id not in sessions:
-        return jsonify({'error': 'Session not found'}), 404
+    if not sessions.delete(session_id):
+        return json_response({'error': 'Session not found'}, 404)
     
-    del sessions[session_id]
     logger.info(f"Deleted session {session_id}")
     
-    return jsonify({'status': 'deleted'})
+    return json_response({'status': 'deleted'})
 
 
 @app.route('/session/<session_id>', methods=['GET'])
 def get_session(session_id: str):
     """Get detailed session information"""
-    if session_id not in sessions:
-        return jsonify({'error': 'Session not found'}), 404
+    session, error = _get_ready_session(session_id)
+    if error is not None:
+        return error
     
-    session = sessions[session_id]
-    return jsonify({
+    return json_response({
         'session_id': session_id,
         'metadata': session['metadata'],
         'status': session['status'],
-        'progress': session['progress']
+        'progress': session['progress'].tolist()
     })
 
 
@@ -391,40 +660,34 @@ def scan_qr():
     Returns parsed metadata
     """
     try:
-        from PIL import Image
-        from pyzbar.pyzbar import decode
-        
         if 'image' not in request.files:
-            return jsonify({'error': 'No image file provided'}), 400
-        
-        file = request.files['image']
-        img = Image.open(file.stream)
+            return json_response({'error': 'No image file provided'}, 400)
         
-        # Decode QR code
-        decoded_objects = decode(img)
+        qr_data = decode_qr_image(request.files['image'].read())
         
-        if not decoded_objects:
-            return jsonify({'error': 'No QR code found in image'}), 400
+        if not qr_data:
+            return json_response({'error': 'No QR code found in image'}, 400)
         
-        qr_data = decoded_objects[0].data.decode('utf-8')
-        metadata = json.loads(qr_data)
+        # orjson parses the decoded bytes directly
+        metadata = orjson.loads(qr_data)
         
-        return jsonify({
+        return json_response({
             'success': True,
             'metadata': metadata
         })
         
     except ImportError:
-        return jsonify({
-            'error': 'QR scanning requires pillow and pyzbar packages',
-            'install': 'pip install pillow pyzbar'
-        }), 501
+        return json_response({
+            'error': 'QR scanning requires opencv-python-headless, or pillow and pyzbar',
+            'install': 'pip install opencv-python-headless'
+        }, 501)
     except Exception as e:
         logger.error(f"Error scanning QR: {e}")
-        return jsonify({'error': str(e)}), 500
+        return json_response({'error': str(e)}, 500)
 
 
 if __name__ == '__main__':
+    # Development server only; production runs wsgi:app under Gunicorn
     logger.info("Starting AirTrans API server...")
     logger.info(f"Local IP: {get_local_ip()}")
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    app.run(host=config.API_HOST, port=config.API_PORT, debug=config.DEBUG)
\ No newline at end of file
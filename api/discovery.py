@@ -2,41 +2,91 @@
 AirTrans Peer Discovery - UDP broadcast for finding nearby devices
 """
 
+import heapq
+import select
+import selectors
 import socket
-import json
+import orjson
 import threading
 import time
-from typing import Dict, List, Callable, Optional
+import uuid
+from typing import Dict, List, Callable, Optional, Tuple
 import logging
 
+from api.utils import get_local_ip
+
 logger = logging.getLogger(__name__)
 
 
+class _StopSignal:
+    """
+    Self-pipe that wakes discovery threads blocked in select() on stop.
+    A socket pair rather than os.pipe(): on Windows select() only accepts sockets.
+    """
+    
+    def __init__(self):
+        self._r, self._w = socket.socketpair()
+    
+    def fileno(self) -> int:
+        return self._r.fileno()
+    
+    def set(self):
+        """Wake every thread waiting on this signal"""
+        try:
+            self._w.send(b'\0')
+        except OSError:
+            pass
+    
+    def wait(self, timeout: float) -> bool:
+        """Sleep up to timeout seconds; returns True if stop was signalled"""
+        readable, _, _ = select.select([self._r], [], [], timeout)
+        return bool(readable)
+    
+    def close(self):
+        self._r.close()
+        self._w.close()
+
+
 class PeerDiscovery:
     """Handle peer discovery via UDP broadcast"""
     
     BROADCAST_PORT = 37020
+    PEER_TIMEOUT = 30  # seconds without an announcement before a peer is dropped
     DISCOVERY_MESSAGE = "AIRTRANS_DISCOVERY"
     RESPONSE_MESSAGE = "AIRTRANS_PEER"
+    # Wire forms of the prefixes so received packets are matched without decoding
+    _DISCOVERY_PREFIX = DISCOVERY_MESSAGE.encode('utf-8')
+    _RESPONSE_PREFIX = RESPONSE_MESSAGE.encode('utf-8')
     
     def __init__(self, device_name: str = None, api_port: int = 8000):
         self.device_name = device_name or socket.gethostname()
         self.api_port = api_port
         self.peers: Dict[str, Dict] = {}
+        # (last_seen, peer_id) min-heap; entries whose peer has been seen
+        # again since are skipped when they reach the top
+        self._peer_heap: List[Tuple[float, str]] = []
+        self._peers_lock = threading.Lock()
         self.running = False
         self.listen_thread = None
         self.announce_thread = None
+        self._sock: Optional[socket.socket] = None
+        self._stop: Optional[_StopSignal] = None
+        self._local_ip = get_local_ip()
+        # Tells this instance's announcements apart from those of other
+        # instances on the same host, which share its IP
+        self.instance_id = uuid.uuid4().hex
+        self._peer_info: Dict = {}
         
     def get_local_ip(self) -> str:
-        """Get local IP address"""
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except Exception:
-            return "127.0.0.1"
+        """Get local IP address (cached; see refresh_local_ip)"""
+        return self._local_ip
+    
+    def refresh_local_ip(self) -> str:
+        """Re-detect the local IP address, e.g. after a network change"""
+        get_local_ip.cache_clear()
+        self._local_ip = get_local_ip()
+        self._peer_info['ip'] = self._local_ip
+        return self._local_ip
     
     def start(self, on_peer_found: Optional[Callable] = None):
         """
@@ -52,6 +102,21 @@ class PeerDiscovery:
         self.running = True
         self.on_peer_found = on_peer_found
         
+        # Everything we announce is fixed except the timestamp, so build it once
+        self._peer_info = {
+            'type': self.RESPONSE_MESSAGE,
+            'instance_id': self.instance_id,
+            'device_name': self.device_name,
+            'ip': self._local_ip,
+            'api_port': self.api_port,
+            'timestamp': 0.0
+        }
+        
+        # One socket serves both threads: the listener receives on it and the
+        # announcer broadcasts from it
+        self._sock = self._open_socket()
+        self._stop = _StopSignal()
+        
         # Start listener thread
         self.listen_thread = threading.Thread(target=self._listen_for_peers, daemon=True)
         self.listen_thread.start()
@@ -65,81 +130,108 @@ class PeerDiscovery:
     def stop(self):
         """Stop discovery service"""
         self.running = False
+        if self._stop:
+            self._stop.set()
         if self.listen_thread:
             self.listen_thread.join(timeout=2)
         if self.announce_thread:
             self.announce_thread.join(timeout=2)
+        if self._sock:
+            self._sock.close()
+            self._sock = None
+        if self._stop:
+            self._stop.close()
+            self._stop = None
         logger.info("Peer discovery stopped")
     
-    def _listen_for_peers(self):
-        """Listen for discovery broadcasts from other peers"""
+    def _open_socket(self) -> socket.socket:
+        """Create the broadcast socket shared by the listener and announcer"""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Lets other AirTrans processes on this host bind the port too
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # Room for bursts of announcements when many peers are present
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
         sock.bind(('', self.BROADCAST_PORT))
-        sock.settimeout(1.0)
+        return sock
+    
+    def _listen_for_peers(self):
+        """Listen for discovery broadcasts from other peers"""
+        sock = self._sock
+        stop = self._stop
         
         logger.info(f"Listening for peers on port {self.BROADCAST_PORT}")
         
+        # Block until a datagram arrives or stop() writes to the self-pipe
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
+        sel.register(stop, selectors.EVENT_READ)
+        
         while self.running:
             try:
+                ready = sel.select()
+                if any(key.fileobj is stop for key, _ in ready):
+                    break
+                
                 data, addr = sock.recvfrom(1024)
-                message = data.decode('utf-8')
                 
-                if message.startswith(self.DISCOVERY_MESSAGE):
+                if data.startswith(self._DISCOVERY_PREFIX):
                     # Received discovery request - send response
                     self._send_peer_response(sock, addr[0])
                     
-                elif message.startswith(self.RESPONSE_MESSAGE):
-                    # Received peer information
-                    self._process_peer_info(message, addr[0])
+                elif data[:1] == b'{' or data.startswith(self._RESPONSE_PREFIX):
+                    # Received peer information (announcements are bare JSON)
+                    self._process_peer_info(data, addr[0])
                     
-            except socket.timeout:
-                continue
             except Exception as e:
                 if self.running:
                     logger.error(f"Error in discovery listener: {e}")
         
-        sock.close()
+        sel.close()
     
     def _send_peer_response(self, sock: socket.socket, peer_ip: str):
         """Send peer information in response to discovery"""
-        peer_info = {
-            'type': self.RESPONSE_MESSAGE,
-            'device_name': self.device_name,
-            'ip': self.get_local_ip(),
-            'api_port': self.api_port,
-            'timestamp': time.time()
-        }
-        
-        response = json.dumps(peer_info)
+        self._peer_info['timestamp'] = time.time()
+        response = orjson.dumps(self._peer_info)
         try:
-            sock.sendto(response.encode('utf-8'), (peer_ip, self.BROADCAST_PORT))
+            sock.sendto(response, (peer_ip, self.BROADCAST_PORT))
             logger.debug(f"Sent peer response to {peer_ip}")
         except Exception as e:
             logger.error(f"Error sending peer response: {e}")
     
-    def _process_peer_info(self, message: str, peer_ip: str):
+    def _process_peer_info(self, message: bytes, peer_ip: str):
         """Process received peer information"""
         try:
-            # Parse JSON from message
-            json_start = message.index('{')
-            peer_data = json.loads(message[json_start:])
+            # Parse JSON straight from the datagram bytes
+            if message[:1] != b'{':
+                message = message[message.index(b'{'):]
+            peer_data = orjson.loads(message)
             
-            peer_id = peer_data['ip']
+            instance_id = peer_data.get('instance_id')
+            if instance_id == self.instance_id:
+                return  # Our own broadcast echoed back
+            # Peers predating instance ids are known by IP alone
+            peer_id = instance_id or peer_data['ip']
+            last_seen = time.time()
             
-            # Check if this is a new peer
-            is_new = peer_id not in self.peers
-            
-            # Update peer information
-            self.peers[peer_id] = {
-                'device_name': peer_data.get('device_name', 'Unknown'),
-                'ip': peer_data['ip'],
-                'api_port': peer_data.get('api_port', 8000),
-                'last_seen': time.time()
-            }
+            with self._peers_lock:
+                # Check if this is a new peer
+                is_new = peer_id not in self.peers
+                
+                # Update peer information
+                self.peers[peer_id] = {
+                    'device_name': peer_data.get('device_name', 'Unknown'),
+                    'ip': peer_data['ip'],
+                    'api_port': peer_data.get('api_port', 8000),
+                    'last_seen': last_seen
+                }
+                heapq.heappush(self._peer_heap, (last_seen, peer_id))
+                self._expire_peers(last_seen)
             
             if is_new:
-                logger.info(f"Discovered peer: {peer_data['device_name']} ({peer_id})")
+                logger.info(f"Discovered peer: {peer_data['device_name']} ({peer_data['ip']})")
                 if self.on_peer_found:
                     self.on_peer_found(self.peers[peer_id])
             
@@ -148,37 +240,27 @@ class PeerDiscovery:
     
     def _announce_presence(self):
         """Periodically broadcast discovery message"""
-        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock = self._sock
+        message = f"{self.DISCOVERY_MESSAGE}:{self.device_name}".encode('utf-8')
         
         while self.running:
             try:
                 # Send discovery broadcast
-                message = f"{self.DISCOVERY_MESSAGE}:{self.device_name}"
-                sock.sendto(message.encode('utf-8'), 
-                           ('<broadcast>', self.BROADCAST_PORT))
+                sock.sendto(message, ('<broadcast>', self.BROADCAST_PORT))
                 
                 # Also send peer info directly
-                peer_info = {
-                    'type': self.RESPONSE_MESSAGE,
-                    'device_name': self.device_name,
-                    'ip': self.get_local_ip(),
-                    'api_port': self.api_port,
-                    'timestamp': time.time()
-                }
-                info_message = json.dumps(peer_info)
-                sock.sendto(info_message.encode('utf-8'),
-                           ('<broadcast>', self.BROADCAST_PORT))
+                self._peer_info['timestamp'] = time.time()
+                info_message = orjson.dumps(self._peer_info)
+                sock.sendto(info_message, ('<broadcast>', self.BROADCAST_PORT))
                 
                 logger.debug("Broadcast discovery announcement")
                 
             except Exception as e:
                 logger.error(f"Error in announce: {e}")
             
-            # Wait before next announcement
-            time.sleep(5)
-        
-        sock.close()
+            # Wait before next announcement (returns early on stop)
+            if self._stop.wait(5):
+                break
     
     def get_peers(self) -> List[Dict]:
         """
@@ -187,18 +269,19 @@ class PeerDiscovery:
         Returns:
             List of peer dictionaries
         """
-        # Remove stale peers (not seen in 30 seconds)
-        current_time = time.time()
-        stale_peers = [
-            peer_id for peer_id, peer in self.peers.items()
-            if current_time - peer['last_seen'] > 30
-        ]
-        
-        for peer_id in stale_peers:
-            logger.info(f"Removing stale peer: {peer_id}")
-            del self.peers[peer_id]
-        
-        return list(self.peers.values())
+        with self._peers_lock:
+            self._expire_peers(time.time())
+            return list(self.peers.values())
+    
+    def _expire_peers(self, current_time: float):
+        """Remove peers not seen within PEER_TIMEOUT, oldest first (lock held)"""
+        heap = self._peer_heap
+        while heap and current_time - heap[0][0] > self.PEER_TIMEOUT:
+            last_seen, peer_id = heapq.heappop(heap)
+            peer = self.peers.get(peer_id)
+            if peer is not None and peer['last_seen'] == last_seen:
+                logger.info(f"Removing stale peer: {peer_id}")
+                del self.peers[peer_id]
     
     def find_peer_by_name(self, device_name: str) -> Optional[Dict]:
         """Find peer by device name"""
@@ -219,10 +302,13 @@ class MulticastDiscovery:
         self.api_port = api_port
         self.peers: Dict[str, Dict] = {}
         self.running = False
+        self._stop: Optional[_StopSignal] = None
+        self._local_ip = get_local_ip()
         
     def start(self):
         """Start multicast discovery"""
         self.running = True
+        self._stop = _StopSignal()
         self.listen_thread = threading.Thread(target=self._listen, daemon=True)
         self.announce_thread = threading.Thread(target=self._announce, daemon=True)
         self.listen_thread.start()
@@ -232,10 +318,15 @@ class MulticastDiscovery:
     def stop(self):
         """Stop multicast discovery"""
         self.running = False
+        if self._stop:
+            self._stop.set()
         if self.listen_thread:
             self.listen_thread.join(timeout=2)
         if self.announce_thread:
             self.announce_thread.join(timeout=2)
+        if self._stop:
+            self._stop.close()
+            self._stop = None
     
     def _listen(self):
         """Listen for multicast messages"""
@@ -248,12 +339,20 @@ class MulticastDiscovery:
         # Join multicast group
         mreq = socket.inet_aton(self.MULTICAST_GROUP) + socket.inet_aton('0.0.0.0')
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, mreq)
-        sock.settimeout(1.0)
+        
+        stop = self._stop
+        sel = selectors.DefaultSelector()
+        sel.register(sock, selectors.EVENT_READ)
+        sel.register(stop, selectors.EVENT_READ)
         
         while self.running:
             try:
+                ready = sel.select()
+                if any(key.fileobj is stop for key, _ in ready):
+                    break
+                
                 data, addr = sock.recvfrom(1024)
-                peer_info = json.loads(data.decode('utf-8'))
+                peer_info = orjson.loads(data)
                 
                 # Don't add ourselves
                 if peer_info['device_name'] != self.device_name:
@@ -261,12 +360,11 @@ class MulticastDiscovery:
                     self.peers[peer_id] = peer_info
                     self.peers[peer_id]['last_seen'] = time.time()
                     
-            except socket.timeout:
-                continue
             except Exception as e:
                 if self.running:
                     logger.error(f"Multicast listen error: {e}")
         
+        sel.close()
         sock.close()
     
     def _announce(self):
@@ -274,35 +372,31 @@ class MulticastDiscovery:
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, 2)
         
+        # Only the timestamp changes between announcements
+        peer_info = {
+            'device_name': self.device_name,
+            'ip': self._get_local_ip(),
+            'api_port': self.api_port,
+            'timestamp': 0.0
+        }
+        
         while self.running:
             try:
-                peer_info = {
-                    'device_name': self.device_name,
-                    'ip': self._get_local_ip(),
-                    'api_port': self.api_port,
-                    'timestamp': time.time()
-                }
-                
-                message = json.dumps(peer_info).encode('utf-8')
+                peer_info['timestamp'] = time.time()
+                message = orjson.dumps(peer_info)
                 sock.sendto(message, (self.MULTICAST_GROUP, self.MULTICAST_PORT))
                 
             except Exception as e:
                 logger.error(f"Multicast announce error: {e}")
             
-            time.sleep(5)
+            if self._stop.wait(5):
+                break
         
         sock.close()
     
     def _get_local_ip(self) -> str:
-        """Get local IP"""
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            s.connect(("8.8.8.8", 80))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except Exception:
-            return "127.0.0.1"
+        """Get local IP (cached)"""
+        return self._local_ip
     
     def get_peers(self) -> List[Dict]:
         """Get discovered peers"""
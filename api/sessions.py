@@ -0,0 +1,262 @@
+"""
+AirTrans Session Store - Transfer session state shared by API workers
+"""
+
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+import logging
+import threading
+import time
+
+import orjson
+
+from config.settings import config
+
+logger = logging.getLogger(__name__)
+
+
+class MemorySessionStore:
+    """
+    Process-local session store (single worker only). Sessions expire
+    SESSION_TIMEOUT after their last write and the oldest are evicted
+    beyond MAX_SESSIONS. A single lock guards every access, and reads
+    return snapshots so callers never see a session mid-update.
+    """
+    
+    def __init__(self, ttl: int = config.SESSION_TIMEOUT, max_sessions: int = config.MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        # session_id -> (expires_at, session), oldest write first
+        self._sessions: "OrderedDict[str, Tuple[float, Dict]]" = OrderedDict()
+        self._qr_codes: Dict[str, Tuple[bytes, str]] = {}
+        self._lock = threading.RLock()
+    
+    def _live(self, session_id: str) -> Optional[Dict]:
+        """Return a stored session, dropping it if it has expired (lock held)"""
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        
+        expires_at, session = entry
+        if expires_at <= time.monotonic():
+            self._drop(session_id)
+            return None
+        return session
+    
+    def _touch(self, session_id: str, session: Dict):
+        """Store a session and restart its expiry (lock held)"""
+        self._sessions[session_id] = (time.monotonic() + self.ttl, session)
+        self._sessions.move_to_end(session_id)
+    
+    def _drop(self, session_id: str):
+        self._sessions.pop(session_id, None)
+        self._qr_codes.pop(session_id, None)
+    
+    def _evict(self):
+        """Drop expired sessions and the oldest beyond max_sessions (lock held)"""
+        now = time.monotonic()
+        while self._sessions:
+            session_id, (expires_at, _) = next(iter(self._sessions.items()))
+            if expires_at > now and len(self._sessions) <= self.max_sessions:
+                break
+            self._drop(session_id)
+    
+    @staticmethod
+    def _snapshot(session: Dict) -> Dict:
+        return {**session, 'progress': session['progress'][:]}
+    
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return a session, or None if it does not exist"""
+        with self._lock:
+            session = self._live(session_id)
+            return self._snapshot(session) if session is not None else None
+    
+    def put(self, session_id: str, session: Dict):
+        """Create or replace a session"""
+        with self._lock:
+            self._touch(session_id, self._snapshot(session))
+            self._evict()
+    
+    def update(self, session_id: str, **fields):
+        """Change top-level fields of an existing session"""
+        with self._lock:
+            session = self._live(session_id)
+            if session is not None:
+                session.update(fields)
+                self._touch(session_id, session)
+    
+    def set_progress(self, session_id: str, progress: Dict[int, int]):
+        """Record bytes transferred for one or more chunks"""
+        with self._lock:
+            session = self._live(session_id)
+            if session is not None:
+                counters = session['progress']
+                for chunk_id, nbytes in progress.items():
+                    counters[chunk_id] = nbytes
+                self._touch(session_id, session)
+    
+    def get_qr(self, session_id: str) -> Optional[Tuple[bytes, str]]:
+        """Return the cached (QR PNG, ETag) for a session, if one was stored"""
+        with self._lock:
+            if self._live(session_id) is None:
+                return None
+            return self._qr_codes.get(session_id)
+    
+    def set_qr(self, session_id: str, png: bytes, etag: str):
+        """Cache the rendered QR PNG for a session along with its ETag"""
+        with self._lock:
+            if self._live(session_id) is not None:
+                self._qr_codes[session_id] = (png, etag)
+    
+    def delete(self, session_id: str) -> bool:
+        """Remove a session; returns False if it did not exist"""
+        with self._lock:
+            existed = self._live(session_id) is not None
+            self._drop(session_id)
+            return existed
+    
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        """Iterate over (session_id, session) pairs"""
+        with self._lock:
+            self._evict()
+            snapshot = [
+                (session_id, self._snapshot(session))
+                for session_id, (_, session) in self._sessions.items()
+            ]
+        return iter(snapshot)
+
+
+class RedisSessionStore:
+    """
+    Redis-backed session store so every API worker sees the same sessions.
+    Each session is a hash of orjson-encoded top-level fields, with its
+    per-chunk progress in a second hash, so workers updating different
+    fields or chunks never overwrite each other. Both keys expire after
+    SESSION_TIMEOUT.
+    """
+    
+    PREFIX = "airtrans:sess:"
+    
+    def __init__(self, url: str, ttl: int = config.SESSION_TIMEOUT):
+        import redis
+        self.ttl = ttl
+        self._redis = redis.Redis(connection_pool=redis.ConnectionPool.from_url(url))
+    
+    def _key(self, session_id: str) -> str:
+        return f"{self.PREFIX}{session_id}"
+    
+    def _progress_key(self, session_id: str) -> str:
+        return f"{self.PREFIX}{session_id}:progress"
+    
+    def _qr_key(self, session_id: str) -> str:
+        return f"{self.PREFIX}{session_id}:qr"
+    
+    @staticmethod
+    def _decode(fields: Dict[bytes, bytes], progress: Dict[bytes, bytes]) -> Optional[Dict]:
+        """Build a session from its field and progress hashes; None if it has no fields"""
+        if not fields:
+            return None
+        
+        session = {name.decode(): orjson.loads(value) for name, value in fields.items()}
+        counters = array('Q', [0]) * session['metadata']['num_parts']
+        for chunk_id, nbytes in progress.items():
+            counters[int(chunk_id)] = int(nbytes)
+        session['progress'] = counters
+        return session
+    
+    def get(self, session_id: str) -> Optional[Dict]:
+        """Return a session, or None if it does not exist"""
+        pipe = self._redis.pipeline()
+        pipe.hgetall(self._key(session_id))
+        pipe.hgetall(self._progress_key(session_id))
+        return self._decode(*pipe.execute())
+    
+    def put(self, session_id: str, session: Dict):
+        """Create or replace a session"""
+        fields = {k: orjson.dumps(v) for k, v in session.items() if k != 'progress'}
+        progress = {chunk_id: nbytes for chunk_id, nbytes in enumerate(session.get('progress', ())) if nbytes}
+        
+        pipe = self._redis.pipeline()
+        pipe.delete(self._key(session_id), self._progress_key(session_id))
+        pipe.hset(self._key(session_id), mapping=fields)
+        pipe.expire(self._key(session_id), self.ttl)
+        if progress:
+            pipe.hset(self._progress_key(session_id), mapping=progress)
+            pipe.expire(self._progress_key(session_id), self.ttl)
+        pipe.execute()
+    
+    def update(self, session_id: str, **fields):
+        """Change top-level fields of an existing session"""
+        key = self._key(session_id)
+        values = {k: orjson.dumps(v) for k, v in fields.items()}
+        
+        def apply(pipe):
+            # HSET only touches these fields; WATCH makes sure a session
+            # deleted or expired meanwhile is not recreated half-empty
+            if not pipe.exists(key):
+                return
+            pipe.multi()
+            pipe.hset(key, mapping=values)
+            pipe.expire(key, self.ttl)
+        
+        self._redis.transaction(apply, key)
+    
+    def set_progress(self, session_id: str, progress: Dict[int, int]):
+        """Record bytes transferred for one or more chunks in a single round trip"""
+        pipe = self._redis.pipeline()
+        pipe.hset(self._progress_key(session_id), mapping=progress)
+        pipe.expire(self._progress_key(session_id), self.ttl)
+        pipe.execute()
+    
+    def get_qr(self, session_id: str) -> Optional[Tuple[bytes, str]]:
+        """Return the cached (QR PNG, ETag) for a session, if one was stored"""
+        png, etag = self._redis.hmget(self._qr_key(session_id), 'png', 'etag')
+        if png is None or etag is None:
+            return None
+        return png, etag.decode()
+    
+    def set_qr(self, session_id: str, png: bytes, etag: str):
+        """Cache the rendered QR PNG for a session along with its ETag"""
+        pipe = self._redis.pipeline()
+        pipe.hset(self._qr_key(session_id), mapping={'png': png, 'etag': etag})
+        pipe.expire(self._qr_key(session_id), self.ttl)
+        pipe.execute()
+    
+    def delete(self, session_id: str) -> bool:
+        """Remove a session; returns False if it did not exist"""
+        self._redis.delete(self._qr_key(session_id))
+        return self._redis.delete(self._key(session_id), self._progress_key(session_id)) > 0
+    
+    def items(self) -> Iterator[Tuple[str, Dict]]:
+        """Iterate over (session_id, session) pairs"""
+        session_ids = []
+        for key in self._redis.scan_iter(match=f"{self.PREFIX}*"):
+            key = key.decode()
+            if not key.endswith((':progress', ':qr')):
+                session_ids.append(key[len(self.PREFIX):])
+        
+        # Fetch every session in one round trip instead of one per key
+        pipe = self._redis.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.hgetall(self._key(session_id))
+            pipe.hgetall(self._progress_key(session_id))
+        replies = pipe.execute()
+        
+        for session_id, fields, progress in zip(session_ids, replies[::2], replies[1::2]):
+            session = self._decode(fields, progress)
+            if session is not None:
+                yield session_id, session
+
+
+def create_session_store():
+    """Use Redis when AIRTRANS_REDIS_URL is set, otherwise keep sessions in memory"""
+    if config.REDIS_URL:
+        try:
+            store = RedisSessionStore(config.REDIS_URL)
+            logger.info("Using Redis session store")
+            return store
+        except ImportError:
+            logger.warning("AIRTRANS_REDIS_URL is set but redis is not installed; "
+                           "keeping sessions in memory")
+    return MemorySessionStore()
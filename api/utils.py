@@ -2,14 +2,166 @@
 AirTrans Utilities - File chunking, merging, compression, and integrity checks
 """
 
+import functools
 import hashlib
+import itertools
+import lz4.block
 import lz4.frame
+import mmap
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Tuple
 import logging
 
+try:
+    import blake3  # SIMD BLAKE3 (Rust) for chunk checksums
+except ImportError:
+    blake3 = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import google_crc32c  # SSE4.2 / ARMv8 CRC32C instructions
+except ImportError:
+    google_crc32c = None
+
+from config.settings import config
+
 logger = logging.getLogger(__name__)
 
+# Read size when hashing a byte range; hashlib drops the GIL for large updates
+HASH_BLOCK_SIZE = 1024 * 1024
+# Reusable buffer size for copies that have to pass through userspace
+COPY_BUFFER_SIZE = 4 * 1024 * 1024
+# Chunk boundaries fall on multiples of this (of the page size for small files)
+CHUNK_ALIGN = 4 * 1024 * 1024
+
+
+# Algorithms usable for per-chunk checksums. These only guard transfers
+# against corruption; the whole-file checksum is always SHA-256.
+CHUNK_HASHES: Dict[str, Callable] = {'sha256': hashlib.sha256}
+if blake3 is not None:
+    CHUNK_HASHES['blake3'] = blake3.blake3
+if xxhash is not None:
+    CHUNK_HASHES['xxh3_128'] = xxhash.xxh3_128
+if google_crc32c is not None:
+    CHUNK_HASHES['crc32c'] = google_crc32c.Checksum
+
+# Chunk hashes strong enough for their tree checksum to stand in for the
+# file's SHA-256; with any other, receivers verify the whole file too
+CRYPTOGRAPHIC_CHUNK_HASHES = frozenset({'sha256', 'blake3'})
+
+
+# Empty hash objects to copy from: cheaper than constructing and initialising
+# a new one for every chunk
+_EMPTY_CHUNK_HASHES = {name: new_hash() for name, new_hash in CHUNK_HASHES.items()}
+
+
+def new_chunk_hash(algorithm: str, data: bytes = b''):
+    """New hash object for chunk checksums with the named algorithm"""
+    try:
+        hash_obj = _EMPTY_CHUNK_HASHES[algorithm].copy()
+    except KeyError:
+        raise ValueError(f"Chunk hash '{algorithm}' is not available; install it or use sha256") from None
+    if data:
+        hash_obj.update(data)
+    return hash_obj
+
+
+@functools.lru_cache(maxsize=1)
+def chunk_hash_algo() -> str:
+    """Chunk hash to use: AIRTRANS_CHUNK_HASH, or sha256 if that one is not installed"""
+    algorithm = config.CHUNK_HASH_ALGO
+    if algorithm not in CHUNK_HASHES:
+        logger.warning(f"Chunk hash '{algorithm}' is not available, using sha256")
+        return 'sha256'
+    return algorithm
+
+
+@functools.lru_cache(maxsize=1)
+def _hash_pool() -> ThreadPoolExecutor:
+    """Threads shared by every checksum job, created on first use"""
+    # One per core, plus one for a whole-file hash running beside the chunks
+    return ThreadPoolExecutor(max_workers=(os.cpu_count() or 1) + 1, thread_name_prefix="hash")
+
+
+def chunk_ranges(filesize: int, num_parts: int) -> List[Tuple[int, int]]:
+    """
+    Split a file into num_parts (offset, size) ranges.
+    
+    Boundaries are aligned to CHUNK_ALIGN when chunks are at least that big
+    (else to the page size), so every chunk but the last hashes and maps
+    whole pages and SHA blocks. Aligned units are spread evenly; the last
+    chunk also takes the unaligned tail. Sender, metadata and file splitting
+    all use this so their chunk boundaries agree.
+    """
+    per_part = filesize // num_parts
+    if per_part >= CHUNK_ALIGN:
+        align = CHUNK_ALIGN
+    elif per_part >= mmap.PAGESIZE:
+        align = mmap.PAGESIZE
+    else:
+        align = 1
+    
+    units, tail = divmod(filesize, align)
+    per_chunk, extra = divmod(units, num_parts)
+    
+    sizes = [(per_chunk + 1) * align] * extra + [per_chunk * align] * (num_parts - extra)
+    sizes[-1] += tail
+    return list(zip(itertools.accumulate(sizes, initial=0), sizes))
+
+
+def _copy_range(in_fd: int, out_fd: int, offset: int, count: int) -> int:
+    """
+    Copy count bytes at offset of in_fd to out_fd's current position.
+    
+    Tries copy_file_range (kernel copy, reflink on CoW filesystems), then
+    sendfile, and only copies through userspace if neither is supported.
+    
+    Returns:
+        Number of bytes copied (short only if in_fd ends early)
+    """
+    copied = 0
+    
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < count:
+                n = os.copy_file_range(in_fd, out_fd, count - copied, offset + copied)
+                if n == 0:
+                    return copied
+                copied += n
+            return copied
+        except OSError:
+            pass  # Unsupported here (e.g. EXDEV, ENOSYS); continue with sendfile
+    
+    try:
+        while copied < count:
+            n = os.sendfile(out_fd, in_fd, offset + copied, count - copied)
+            if n == 0:
+                return copied
+            copied += n
+        return copied
+    except OSError:
+        pass
+    
+    # One buffer reused for every slab, so memory stays bounded by its size
+    buf = memoryview(bytearray(min(COPY_BUFFER_SIZE, count - copied)))
+    os.lseek(in_fd, offset + copied, os.SEEK_SET)
+    while copied < count:
+        n = os.readv(in_fd, [buf[:min(len(buf), count - copied)]])
+        if n == 0:
+            break
+        view = buf[:n]
+        while view:
+            view = view[os.write(out_fd, view):]
+        copied += n
+    return copied
+
 
 class FileChunker:
     """Handles splitting large files into chunks"""
@@ -17,7 +169,8 @@ class FileChunker:
     @staticmethod
     def split_file(filepath: str, num_parts: int, output_dir: Optional[str] = None) -> List[str]:
         """
-        Split a file into N equal parts
+        Split a file into N parts cut on the aligned boundaries of
+        chunk_ranges, so part i holds exactly chunk i of a transfer
         
         Args:
             filepath: Path to the file to split
@@ -37,28 +190,21 @@ class FileChunker:
         
         output_dir.mkdir(parents=True, exist_ok=True)
         
-        chunk_size = filesize // num_parts
         chunk_paths = []
         
         logger.info(f"Splitting {filepath.name} ({filesize} bytes) into {num_parts} parts")
         
         with open(filepath, 'rb') as infile:
-            for i in range(num_parts):
+            for i, (offset, size) in enumerate(chunk_ranges(filesize, num_parts)):
                 chunk_path = output_dir / f"{filepath.stem}.part{i:04d}"
                 
-                # Calculate size for this chunk
-                current_chunk_size = chunk_size
-                if i == num_parts - 1:
-                    # Last chunk gets any remaining bytes
-                    current_chunk_size = filesize - (chunk_size * (num_parts - 1))
-                
-                # Read and write chunk
-                chunk_data = infile.read(current_chunk_size)
+                # Copy chunk inside the kernel, never through Python bytes
                 with open(chunk_path, 'wb') as outfile:
-                    outfile.write(chunk_data)
+                    written = _copy_range(infile.fileno(), outfile.fileno(), offset, size)
                 
                 chunk_paths.append(str(chunk_path))
-                logger.info(f"Created chunk {i}: {chunk_path.name} ({len(chunk_data)} bytes)")
+                # Lazy %-formatting: per-chunk messages cost nothing when INFO is off
+                logger.info("Created chunk %d: %s (%d bytes)", i, chunk_path.name, written)
         
         return chunk_paths
     
@@ -80,18 +226,26 @@ class FileChunker:
         
         logger.info(f"Merging {num_parts} chunks into {output_path.name}")
         
+        # Index chunk files by part number in one directory scan
+        parts = {}
+        with os.scandir(chunk_dir) as entries:
+            for entry in entries:
+                _, sep, index = entry.name.rpartition('.part')
+                if sep and index.isdigit() and entry.is_file():
+                    parts[int(index)] = Path(entry.path)
+        
         with open(output_path, 'wb') as outfile:
             for i in range(num_parts):
                 # Find chunk file
-                chunk_files = list(chunk_dir.glob(f"*.part{i:04d}"))
-                if not chunk_files:
+                chunk_path = parts.get(i)
+                if chunk_path is None:
                     raise FileNotFoundError(f"Chunk {i} not found in {chunk_dir}")
                 
-                chunk_path = chunk_files[0]
                 with open(chunk_path, 'rb') as infile:
-                    chunk_data = infile.read()
-                    outfile.write(chunk_data)
-                    logger.info(f"Merged chunk {i}: {chunk_path.name}")
+                    # Kernel copy (a reflink on CoW filesystems); never loads the chunk into memory
+                    size = os.fstat(infile.fileno()).st_size
+                    _copy_range(infile.fileno(), outfile.fileno(), 0, size)
+                    logger.info("Merged chunk %d: %s", i, chunk_path.name)
         
         logger.info(f"Merge complete: {output_path}")
         return str(output_path)
@@ -100,6 +254,36 @@ class FileChunker:
 class ChecksumManager:
     """Handles file integrity verification"""
     
+    @staticmethod
+    def _sha256_new(data: bytes = b''):
+        """
+        New SHA-256 hash object. hashlib's is OpenSSL's, which already
+        dispatches to SHA-NI / AVX2 code at runtime; copying an empty one
+        skips the name lookup and setup of hashlib.new('sha256').
+        """
+        hash_obj = _EMPTY_CHUNK_HASHES['sha256'].copy()
+        if data:
+            hash_obj.update(data)
+        return hash_obj
+    
+    @staticmethod
+    def _hash_new(algorithm: str):
+        """New hash object for algorithm, using the fast path for sha256"""
+        if algorithm == 'sha256':
+            return ChecksumManager._sha256_new()
+        return hashlib.new(algorithm)
+    
+    @staticmethod
+    def _map_file(f) -> Optional[mmap.mmap]:
+        """Read-only mapping of an open file, or None if it cannot be mapped (e.g. empty)"""
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            return None
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        return mm
+    
     @staticmethod
     def calculate_file_checksum(filepath: str, algorithm: str = 'sha256') -> str:
         """
@@ -112,38 +296,126 @@ class ChecksumManager:
         Returns:
             Hex digest of the hash
         """
-        hash_obj = hashlib.new(algorithm)
+        hash_obj = ChecksumManager._hash_new(algorithm)
         
         with open(filepath, 'rb') as f:
-            # Read in chunks to handle large files
-            for chunk in iter(lambda: f.read(8192), b''):
-                hash_obj.update(chunk)
+            mm = ChecksumManager._map_file(f)
+            if mm is not None:
+                # Hash straight from the page cache, without copying into bytes
+                with mm:
+                    hash_obj.update(mm)
+            elif hasattr(hashlib, 'file_digest'):
+                # Python 3.11+: the read loop runs in C with the GIL released
+                hashlib.file_digest(f, lambda: hash_obj)
+            else:
+                # Read in chunks to handle large files
+                for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                    hash_obj.update(chunk)
         
         return hash_obj.hexdigest()
     
     @staticmethod
-    def calculate_chunk_checksums(filepath: str, num_parts: int) -> List[str]:
+    def _hash_mapped(new_hash: Callable, mm: mmap.mmap, offset: int, size: int) -> str:
+        """Hex digest of size bytes at offset of a mapped file"""
+        with memoryview(mm)[offset:offset + size] as view:
+            return new_hash(view).hexdigest()
+    
+    @staticmethod
+    def _hash_range(new_hash: Callable, fd: int, offset: int, size: int) -> str:
+        """Hex digest of size bytes at offset, read with pread"""
+        hash_obj = new_hash()
+        end = offset + size
+        while offset < end:
+            block = os.pread(fd, min(HASH_BLOCK_SIZE, end - offset), offset)
+            if not block:
+                break
+            hash_obj.update(block)
+            offset += len(block)
+        return hash_obj.hexdigest()
+    
+    @staticmethod
+    def _hash_chunks(filepath: str, num_parts: int, whole_file: bool, algorithm: str,
+                     filesize: Optional[int] = None) -> Tuple[Optional[str], List[str]]:
+        """
+        Hash each chunk of a file with algorithm, and optionally the whole
+        file with SHA-256, from one mapping of it (pread where it cannot be
+        mapped).
+        
+        Chunks are independent, so they are hashed in parallel threads (one
+        per core); the whole-file hash runs alongside them as one more job.
+        """
+        if filesize is None:
+            filesize = Path(filepath).stat().st_size
+        pool = _hash_pool()
+        chunk_hash = functools.partial(new_chunk_hash, algorithm)
+        
+        with open(filepath, 'rb') as f:
+            mm = ChecksumManager._map_file(f)
+            if mm is not None:
+                hash_range, source = ChecksumManager._hash_mapped, mm
+            else:
+                hash_range, source = ChecksumManager._hash_range, f.fileno()
+            
+            futures = []
+            try:
+                # Submitted first: it is the longest job
+                if whole_file:
+                    futures.append(pool.submit(hash_range, ChecksumManager._sha256_new, source, 0, filesize))
+                
+                for offset, size in chunk_ranges(filesize, num_parts):
+                    futures.append(pool.submit(hash_range, chunk_hash, source, offset, size))
+                
+                checksums = [future.result() for future in futures]
+            finally:
+                if mm is not None:
+                    # Workers have finished with their views once results are in
+                    for future in futures:
+                        future.exception()
+                    mm.close()
+        
+        if whole_file:
+            return checksums[0], checksums[1:]
+        return None, checksums
+    
+    @staticmethod
+    def calculate_chunk_checksums(filepath: str, num_parts: int, algorithm: Optional[str] = None) -> List[str]:
         """
         Calculate checksums for each chunk of a file
         
+        Args:
+            algorithm: Chunk hash (defaults to chunk_hash_algo())
+        
         Returns:
             List of checksums, one per chunk
         """
-        filesize = Path(filepath).stat().st_size
-        chunk_size = filesize // num_parts
-        checksums = []
+        algorithm = algorithm or chunk_hash_algo()
+        return ChecksumManager._hash_chunks(filepath, num_parts, False, algorithm)[1]
+    
+    @staticmethod
+    def calculate_all(filepath: str, num_parts: int, algorithm: Optional[str] = None,
+                      filesize: Optional[int] = None) -> Tuple[str, List[str]]:
+        """
+        Calculate the SHA-256 of the whole file and the checksum of each
+        chunk together, mapping the file once instead of once per checksum
         
-        with open(filepath, 'rb') as f:
-            for i in range(num_parts):
-                current_chunk_size = chunk_size
-                if i == num_parts - 1:
-                    current_chunk_size = filesize - (chunk_size * (num_parts - 1))
-                
-                chunk_data = f.read(current_chunk_size)
-                checksum = hashlib.sha256(chunk_data).hexdigest()
-                checksums.append(checksum)
+        Returns:
+            (file checksum, list of chunk checksums)
+        """
+        algorithm = algorithm or chunk_hash_algo()
+        return ChecksumManager._hash_chunks(filepath, num_parts, True, algorithm, filesize)
+    
+    @staticmethod
+    def calculate_tree_checksum(chunk_checksums: List[str]) -> str:
+        """
+        Calculate the tree checksum (root hash) of a file from its chunk checksums
         
-        return checksums
+        The root is the SHA-256 of the concatenated hex chunk digests, so it can
+        be verified from per-chunk checksums without another pass over the file.
+        
+        Returns:
+            Hex digest of the root hash
+        """
+        return ChecksumManager._sha256_new(''.join(chunk_checksums).encode()).hexdigest()
     
     @staticmethod
     def verify_file(filepath: str, expected_checksum: str, algorithm: str = 'sha256') -> bool:
@@ -169,6 +441,14 @@ class ChecksumManager:
 class CompressionManager:
     """Handles optional file compression using LZ4 for speed"""
     
+    # Files are SHA-256 verified end to end, so frames skip LZ4's own content
+    # checksum and use large independent blocks
+    FRAME_OPTIONS = {
+        'block_size': lz4.frame.BLOCKSIZE_MAX4MB,
+        'block_linked': False,
+        'content_checksum': False,
+    }
+    
     @staticmethod
     def compress_file(filepath: str, output_path: Optional[str] = None) -> str:
         """
@@ -190,13 +470,14 @@ class CompressionManager:
         logger.info(f"Compressing {filepath.name} with LZ4")
         
         with open(filepath, 'rb') as infile:
-            with lz4.frame.open(output_path, 'wb') as outfile:
-                # Compress in chunks
+            with lz4.frame.open(output_path, 'wb', **CompressionManager.FRAME_OPTIONS) as outfile:
+                # Compress in chunks through one reused buffer
+                buf = memoryview(bytearray(COPY_BUFFER_SIZE))
                 while True:
-                    chunk = infile.read(1024 * 1024)  # 1MB chunks
-                    if not chunk:
+                    n = infile.readinto(buf)
+                    if not n:
                         break
-                    outfile.write(chunk)
+                    outfile.write(buf[:n])
         
         original_size = filepath.stat().st_size
         compressed_size = output_path.stat().st_size
@@ -228,11 +509,12 @@ class CompressionManager:
         
         with lz4.frame.open(filepath, 'rb') as infile:
             with open(output_path, 'wb') as outfile:
+                buf = memoryview(bytearray(COPY_BUFFER_SIZE))
                 while True:
-                    chunk = infile.read(1024 * 1024)
-                    if not chunk:
+                    n = infile.readinto(buf)
+                    if not n:
                         break
-                    outfile.write(chunk)
+                    outfile.write(buf[:n])
         
         logger.info(f"Decompression complete: {output_path}")
         
@@ -247,13 +529,34 @@ class CompressionManager:
     def decompress_data(data: bytes) -> bytes:
         """Decompress bytes in memory"""
         return lz4.frame.decompress(data)
+    
+    @staticmethod
+    def compress_block(data: bytes) -> bytes:
+        """
+        Compress bytes as a bare LZ4 block (no frame header, checksum or
+        stored size); the caller must keep the uncompressed size
+        """
+        return lz4.block.compress(data, mode='fast', acceleration=1, store_size=False)
+    
+    @staticmethod
+    def decompress_block(data: bytes, dst_size: int) -> bytes:
+        """Decompress a block from compress_block given its uncompressed size"""
+        return lz4.block.decompress(data, uncompressed_size=dst_size)
+
+
+@functools.lru_cache(maxsize=32)
+def _file_checksums(filepath: str, num_parts: int, algorithm: str, filesize: int,
+                    mtime_ns: int, inode: int) -> Tuple[str, Tuple[str, ...]]:
+    """calculate_all, memoized on the file's identity so unchanged files are hashed once"""
+    checksum, chunk_checksums = ChecksumManager.calculate_all(filepath, num_parts, algorithm, filesize)
+    return checksum, tuple(chunk_checksums)
 
 
 class TransferMetadata:
     """Helper for creating and parsing transfer metadata"""
     
     @staticmethod
-    def create_metadata(filepath: str, ip: str, ports: List[int], 
+    def create_metadata(filepath: str, ip: str, port: int, 
                        num_parts: int, use_compression: bool = False) -> Dict:
         """
         Create metadata dictionary for transfer session
@@ -262,18 +565,26 @@ class TransferMetadata:
             Dictionary containing all transfer information
         """
         filepath = Path(filepath)
-        filesize = filepath.stat().st_size
-        checksum = ChecksumManager.calculate_file_checksum(str(filepath))
-        chunk_checksums = ChecksumManager.calculate_chunk_checksums(str(filepath), num_parts)
+        st = filepath.stat()
+        filesize = st.st_size
+        chunk_hash = chunk_hash_algo()
+        # Size, mtime and inode key the cache, so a modified file is re-hashed
+        checksum, chunk_checksums = _file_checksums(
+            str(filepath.resolve()), num_parts, chunk_hash, filesize, st.st_mtime_ns, st.st_ino
+        )
+        chunk_checksums = list(chunk_checksums)
         
         metadata = {
             'filename': filepath.name,
             'filesize': filesize,
             'ip': ip,
-            'ports': ports,
+            'port': port,
             'num_parts': num_parts,
+            'chunk_offsets': [offset for offset, _ in chunk_ranges(filesize, num_parts)],
             'checksum': checksum,
+            'chunk_hash': chunk_hash,
             'chunk_checksums': chunk_checksums,
+            'tree_checksum': ChecksumManager.calculate_tree_checksum(chunk_checksums),
             'compression': use_compression,
             'version': '1.0'
         }
@@ -288,27 +599,44 @@ class TransferMetadata:
         Returns:
             True if valid, False otherwise
         """
-        required_fields = ['filename', 'filesize', 'ip', 'ports', 'num_parts', 'checksum']
+        required_fields = ['filename', 'filesize', 'ip', 'port', 'num_parts', 'checksum']
         
         for field in required_fields:
             if field not in metadata:
                 logger.error(f"Missing required field: {field}")
                 return False
         
-        if not isinstance(metadata['ports'], list) or len(metadata['ports']) != metadata['num_parts']:
-            logger.error("Invalid ports configuration")
+        if not isinstance(metadata['port'], int) or not 0 < metadata['port'] <= 65535:
+            logger.error("Invalid port configuration")
             return False
         
         return True
 
 
+@functools.lru_cache(maxsize=1)
+def get_local_ip() -> str:
+    """
+    Get local IP address (detected once; call get_local_ip.cache_clear()
+    after a network change to detect it again)
+    """
+    try:
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.connect(("8.8.8.8", 80))
+        ip = s.getsockname()[0]
+        s.close()
+        return ip
+    except Exception:
+        return "127.0.0.1"
+
+
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+
 def format_size(size_bytes: int) -> str:
     """Format bytes into human-readable string"""
-    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.2f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.2f} PB"
+    # Each unit is 10 more bits, so the bit length picks the unit directly
+    i = min(len(_SIZE_UNITS) - 1, max(0, (int(size_bytes).bit_length() - 1) // 10))
+    return f"{size_bytes / (1 << (10 * i)):.2f} {_SIZE_UNITS[i]}"
 
 
 def calculate_optimal_chunks(filesize: int, target_chunk_size: int = 100 * 1024 * 1024) -> int:
@@ -32,10 +32,7 @@ class Config:
     # File paths
     TEMP_DIR = Path(os.getenv("AIRTRANS_TEMP_DIR", "/tmp/airtrans"))
     DOWNLOAD_DIR = Path(os.getenv("AIRTRANS_DOWNLOAD_DIR", str(Path.home() / "Downloads" / "AirTrans")))
-    
-    # Create directories if they don't exist
-    TEMP_DIR.mkdir(parents=True, exist_ok=True)
-    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    _dirs_ready = False
     
     # Compression
     ENABLE_COMPRESSION = os.getenv("AIRTRANS_COMPRESSION", "False").lower() == "true"
@@ -44,6 +41,11 @@ class Config:
     # Security
     CHECKSUM_ALGORITHM = os.getenv("AIRTRANS_CHECKSUM", "sha256")
     VERIFY_CHECKSUMS = True
+    # Re-hash the whole received file on top of the per-chunk/tree checks
+    # (always done when the chunk hash is not sha256 or blake3)
+    VERIFY_FULL_HASH = os.getenv("AIRTRANS_VERIFY_FULL_HASH", "False").lower() == "true"
+    # Per-chunk checksum: blake3, xxh3_128, crc32c or sha256 (falls back to sha256 if not installed)
+    CHUNK_HASH_ALGO = os.getenv("AIRTRANS_CHUNK_HASH", "blake3").lower()
     
     # Discovery
     DISCOVERY_PORT = int(os.getenv("AIRTRANS_DISCOVERY_PORT", "37020"))
@@ -56,7 +58,11 @@ class Config:
     BUFFER_SIZE = int(os.getenv("AIRTRANS_BUFFER_SIZE", str(1024 * 1024)))  # 1MB
     MAX_CONCURRENT_TRANSFERS = int(os.getenv("AIRTRANS_MAX_TRANSFERS", "5"))
     TCP_NODELAY = True  # Disable Nagle's algorithm for lower latency
+    SOCKET_BUFFER_SIZE = int(os.getenv("AIRTRANS_SOCKET_BUFFER", str(16 * 1024 * 1024)))  # 16MB SO_SNDBUF/SO_RCVBUF
     TCP_QUICKACK = True  # Enable TCP quick ack
+    USE_UVLOOP = os.getenv("AIRTRANS_UVLOOP", "True").lower() == "true"  # Used when installed
+    MAX_BLOCK_SIZE = int(os.getenv("AIRTRANS_MAX_BLOCK_SIZE", str(64 * 1024 * 1024)))  # 64MB cap on BDP-sized blocks
+    LINK_SPEED_MBPS = int(os.getenv("AIRTRANS_LINK_SPEED", "1000"))  # Used when the NIC speed is unknown
     
     # Logging
     LOG_LEVEL = os.getenv("AIRTRANS_LOG_LEVEL", "INFO")
@@ -71,6 +77,7 @@ class Config:
     # Session management
     SESSION_TIMEOUT = int(os.getenv("AIRTRANS_SESSION_TIMEOUT", "3600"))  # 1 hour
     MAX_SESSIONS = int(os.getenv("AIRTRANS_MAX_SESSIONS", "100"))
+    REDIS_URL = os.getenv("AIRTRANS_REDIS_URL", "")  # e.g. redis://localhost:6379/0; empty keeps sessions in memory
     
     # Network
     MAX_RETRIES = int(os.getenv("AIRTRANS_MAX_RETRIES", "3"))
@@ -89,11 +96,18 @@ class Config:
     @classmethod
     def format_bytes(cls, size: int) -> str:
         """Format bytes into human-readable string"""
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size < 1024.0:
-                return f"{size:.2f} {unit}"
-            size /= 1024.0
-        return f"{size:.2f} PB"
+        units = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+        i = min(len(units) - 1, max(0, (int(size).bit_length() - 1) // 10))
+        return f"{size / (1 << (10 * i)):.2f} {units[i]}"
+    
+    @classmethod
+    def ensure_dirs(cls):
+        """Create TEMP_DIR and DOWNLOAD_DIR if missing (once per process, at startup)"""
+        if cls._dirs_ready:
+            return
+        cls.TEMP_DIR.mkdir(parents=True, exist_ok=True)
+        cls.DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+        cls._dirs_ready = True
     
     @classmethod
     def validate(cls):
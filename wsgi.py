@@ -0,0 +1,14 @@
+"""
+AirTrans WSGI entrypoint - serve the API with Gunicorn thread workers
+
+    gunicorn wsgi:app --workers 1 --worker-class gthread --threads 16 \
+        --bind 0.0.0.0:8000
+
+Threads (not gevent) so session setup and verification keep hashing on real
+threads in parallel. Sessions are only shared between workers when
+AIRTRANS_REDIS_URL is set, so raise --workers only together with it.
+"""
+
+from api.app import app
+
+__all__ = ['app']